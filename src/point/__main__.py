@@ -1,7 +1,10 @@
 import argparse
-import ssl
+import signal
+import sys
+import threading
 from sys import stderr
 
+from .profiles import importnumpy
 from .server import MockPWM, RESTHandler, Server
 
 if __name__ == "__main__":
@@ -53,7 +56,13 @@ if __name__ == "__main__":
         "--secret",
         type=str,
         default="secret",
-        help="Filename of server name:password to use in basic authentication, default secret",
+        help="Filename with a user:password line for every user that may use basic authentication, default secret",
+    )
+    argparser.add_argument(
+        "--tokenlifetime",
+        type=int,
+        default=3600,
+        help="seconds a token handed out by POST /server/token stays valid, default 3600",
     )
     argparser.add_argument(
         "-m",
@@ -62,25 +71,140 @@ if __name__ == "__main__":
         action="store_true",
         help="do not run an actual servo controller",
     )
+    argparser.add_argument(
+        "--simulate",
+        default=False,
+        action="store_true",
+        help="run the servo controllers on a simulated i2c bus with the timing of a real one",
+    )
+    argparser.add_argument(
+        "--busspeed",
+        type=int,
+        choices=(100, 400),
+        default=400,
+        help="speed in kHz of the simulated i2c bus, default 400",
+    )
+    argparser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="file to record all transactions on the simulated i2c bus in, print it with python -m point.simbus",
+    )
     argparser.add_argument(
         "-i",
         "--i2c",
-        default=0x40,
-        help="address of the controller on the i2c bus, default 0x40",
+        type=lambda s: int(s, 0),
+        nargs="+",
+        default=[0x40],
+        help="addresses of the controllers on the i2c bus, ports 0-15 are on the first controller, 16-31 on the second, etc. default 0x40",
     )
     argparser.add_argument(
         "-b", "--backupdir", default="./backup", help="path to backup directory"
     )
+    argparser.add_argument(
+        "--backupkeep",
+        type=int,
+        default=0,
+        help="maximum number of backups to keep, default 0 (no maximum)",
+    )
+    argparser.add_argument(
+        "--backupdays",
+        type=float,
+        default=0,
+        help="remove backups older than this many days, default 0 (keep them)",
+    )
     argparser.add_argument(
         "-l", "--log", default="./points.log", help="path to log file"
     )
+    argparser.add_argument(
+        "--logsize",
+        type=int,
+        default=1048576,
+        help="size in bytes beyond which the log file is rotated, default 1048576",
+    )
+    argparser.add_argument(
+        "--logbackups",
+        type=int,
+        default=3,
+        help="number of rotated log files to keep, default 3",
+    )
+    argparser.add_argument(
+        "--logjson",
+        default=False,
+        action="store_true",
+        help="write the log as lines of JSON instead of the common log format",
+    )
+    argparser.add_argument(
+        "-t",
+        "--tick",
+        type=float,
+        default=0.02,
+        help="seconds between position updates of moving points, default 0.02",
+    )
+    argparser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=8,
+        help="number of threads that handle requests concurrently, 0 handles one connection at a time, default 8",
+    )
+    argparser.add_argument(
+        "-k",
+        "--keepalive",
+        type=float,
+        default=15,
+        help="seconds before an idle connection is closed, default 15",
+    )
+    argparser.add_argument(
+        "-a",
+        "--asyncio",
+        default=False,
+        action="store_true",
+        help="use an asyncio based server that also offers a stream of point changes on /server/events",
+    )
+    argparser.add_argument(
+        "-d",
+        "--savedelay",
+        type=float,
+        default=1.0,
+        help="seconds to wait before changes are written to the journal, so that changes in quick succession are written in one go, default 1.0",
+    )
+    argparser.add_argument(
+        "-j",
+        "--journalsize",
+        type=int,
+        default=65536,
+        help="size in bytes of the journal beyond which the json file is rewritten and the journal emptied, default 65536",
+    )
+    argparser.add_argument(
+        "--budget",
+        type=float,
+        default=0,
+        help="amperes all moving servos together may draw, moves wait until their cost fits, default 0 (no limit)",
+    )
+    argparser.add_argument(
+        "--boardbudget",
+        type=float,
+        default=0,
+        help="amperes the moving servos on a single controller may draw, default 0 (no limit)",
+    )
     args = argparser.parse_args()
+    bus = None  # all controllers share a single bus
     if args.mock:
-        pwm = MockPWM()
+        pwm = MockPWM(channels=16 * len(args.i2c))
     else:
         from .pca9685 import PCA9685
+        from .pool import ControllerPool
 
-        pwm = PCA9685(args.i2c, debug=False)
+        if args.simulate:
+            from .simbus import SimBus
+
+            bus = SimBus(args.i2c, args.busspeed * 1000, trace=args.trace)
+        boards = []
+        for address in args.i2c:
+            boards.append(PCA9685(address, debug=False, bus=bus))
+            bus = boards[0].bus
+        pwm = ControllerPool(boards)
         pwm.setPWMFreq(50)
 
     server = Server(
@@ -91,10 +215,36 @@ if __name__ == "__main__":
         args.secret,
         args.backupdir,
         args.log,
+        tick=args.tick,
+        workers=args.workers,
+        keepalive=args.keepalive,
+        bind_and_activate=not args.asyncio,
+        savedelay=args.savedelay,
+        journalsize=args.journalsize,
+        logsize=args.logsize,
+        logbackups=args.logbackups,
+        backupkeep=args.backupkeep,
+        backupdays=args.backupdays,
+        budget=args.budget,
+        boardbudget=args.boardbudget,
+        logjson=args.logjson,
+        tokenlifetime=args.tokenlifetime,
     )
+    context = None
     if not args.nossl:
-        server.socket = ssl.wrap_socket(
-            server.socket, keyfile=args.key, certfile=args.cert, server_side=True
+        import ssl
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile=args.cert, keyfile=args.key)
+    if args.asyncio:
+        from .aserver import AsyncServer
+
+        server.socket.close()
+        server = AsyncServer(server, (args.server, args.port), ssl=context)
+    elif context is not None:
+        # the handshake is done by the thread handling the connection, not by the one accepting it
+        server.socket = context.wrap_socket(
+            server.socket, server_side=True, do_handshake_on_connect=False
         )
 
     print(
@@ -102,4 +252,15 @@ if __name__ == "__main__":
         file=stderr,
         flush=True,
     )
-    server.serve_forever()
+    # make sure pending changes are written when we are stopped
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # numpy, if present, takes a while to import, so do it while already serving
+    threading.Thread(target=importnumpy, name="import", daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.simulate:
+            bus.close()
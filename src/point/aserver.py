@@ -0,0 +1,136 @@
+import asyncio
+import json
+from io import BytesIO
+from itertools import count
+
+
+class AsyncServer:
+    """An asyncio front end for a Server.
+
+    Regular REST requests are parsed and answered by the same RESTHandler that the
+    threaded Server uses, so both speak exactly the same API. The handler runs in a
+    thread of its own so it can never block the event loop.
+
+    On top of that GET /server/events is a Server-Sent Events stream that pushes
+    every change to a point (including the intermediate positions during a move)
+    to the client as it happens.
+    """
+
+    heartbeat = 15  # seconds between keep alive comments on an idle event stream
+
+    def __init__(self, server, address, ssl=None):
+        self.server = server  # a Server created with bind_and_activate=False
+        self.address = address
+        self.ssl = ssl
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    def server_close(self):
+        self.server.server_close()
+
+    async def serve(self):
+        host, port = self.address
+        aserver = await asyncio.start_server(self.connection, host, port, ssl=self.ssl)
+        async with aserver:
+            await aserver.serve_forever()
+
+    async def connection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), self.server.keepalive
+                    )
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                length = 0
+                for line in head.split(b"\r\n")[1:]:
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                body = await reader.readexactly(length) if length > 0 else b""
+                method, path = (head.split(b" ", 2) + [b"", b""])[:2]
+                if method == b"GET" and path.split(b"?")[0] == b"/server/events":
+                    await self.events(head, writer)
+                    break
+                response, close = await asyncio.get_running_loop().run_in_executor(
+                    self.server.executor, self.handle, head + body, peer
+                )
+                writer.write(response)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def handle(self, request, peer):
+        """Let the RESTHandler of the server answer a complete raw request."""
+        handler = self.server.RequestHandlerClass.__new__(
+            self.server.RequestHandlerClass
+        )
+        handler.server = self.server
+        handler.client_address = peer
+        handler.request = None
+        handler.rfile = BytesIO(request)
+        handler.wfile = BytesIO()
+        handler.close_connection = True
+        handler.handle_one_request()
+        return handler.wfile.getvalue(), handler.close_connection
+
+    def authorized(self, head):
+        for line in head.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"authorization":
+                return self.server.authorized(value.strip().decode("latin-1"))
+        return self.server.authorized(None)
+
+    async def events(self, head, writer):
+        if not self.authorized(head):
+            writer.write(b"HTTP/1.1 401 Unauthorized\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+            return
+        loop = asyncio.get_running_loop()
+        # index -> merged changes of a point, so a slow client gets the latest state,
+        # other events (of routes, a reload) are not merged and get a number as key
+        pending = {}
+        numbers = count()
+        ready = asyncio.Event()
+
+        def merge(event):
+            index = event.get("index")
+            if index is None:
+                pending[next(numbers)] = event
+            else:
+                pending.setdefault(index, {}).update(event)
+            ready.set()
+
+        def publish(event):  # called from the thread that changed the point
+            loop.call_soon_threadsafe(merge, event)
+
+        snapshot, _ = self.server.snapshot()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        writer.write(b"event: snapshot\ndata: " + snapshot.encode() + b"\n\n")
+        self.server.events.subscribe(publish)
+        try:
+            while True:
+                await writer.drain()
+                try:
+                    await asyncio.wait_for(ready.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    writer.write(b": keepalive\n\n")
+                    continue
+                ready.clear()
+                events, pending = list(pending.values()), {}
+                for event in events:
+                    writer.write(b"data: " + json.dumps(event).encode() + b"\n\n")
+        finally:
+            self.server.events.unsubscribe(publish)
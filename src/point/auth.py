@@ -0,0 +1,97 @@
+import hmac
+import os
+from base64 import b64decode, urlsafe_b64decode, urlsafe_b64encode
+from hashlib import sha256
+from time import time
+
+
+def load(path):
+    """Return a dict user -> password from a file with one user:password per line.
+
+    Empty lines and lines starting with # are ignored.
+    """
+    users = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                user, sep, password = line.partition(":")
+                if not sep or not user:
+                    raise ValueError(f"not a user:password line in {path}")
+                users[user] = password
+    if not users:
+        raise ValueError(f"no users in {path}")
+    return users
+
+
+class Authenticator:
+    """Checks the value of Authorization headers.
+
+    Basic credentials are compared in constant time with those of the users. Valid
+    headers are remembered, so a client that sends the same header again is
+    recognized with a single dict lookup.
+
+    A user can also get a bearer token with token(). A token contains the user
+    name and its expiry time, signed with a key that only the server knows, so it
+    is verified without looking anything up. The key is new every time the
+    server starts, which invalidates all tokens that were handed out before.
+    """
+
+    cachesize = 1024  # maximum number of remembered headers
+
+    def __init__(self, users, lifetime=3600, key=None):
+        self.users = {user: password.encode() for user, password in users.items()}
+        self.lifetime = lifetime  # seconds a token stays valid
+        self.key = os.urandom(32) if key is None else key
+        self.cache = {}  # header value -> user
+
+    def check(self, header):
+        """Return the user if header is the value of a valid Authorization header, None otherwise."""
+        if header is None:
+            return None
+        user = self.cache.get(header)
+        if user is not None:
+            return user
+        scheme, _, credentials = header.strip().partition(" ")
+        if scheme == "Bearer":
+            return self.verify(credentials.strip())
+        if scheme != "Basic":
+            return None
+        try:
+            user, _, password = b64decode(credentials, validate=True).partition(b":")
+            user = user.decode()
+        except ValueError:  # also raised for non ascii or malformed base64
+            return None
+        expected = self.users.get(user)
+        # compare even for an unknown user, so it takes as long as a wrong password
+        match = hmac.compare_digest(password, expected or b"")
+        if expected is None or not match:
+            return None
+        if len(self.cache) >= self.cachesize:
+            self.cache.clear()
+        self.cache[header] = user
+        return user
+
+    def sign(self, payload):
+        return hmac.new(self.key, payload, sha256).hexdigest()
+
+    def token(self, user):
+        """Return a (token, expiry time) tuple for user."""
+        expires = int(time()) + self.lifetime
+        payload = urlsafe_b64encode(f"{user}:{expires}".encode()).decode()
+        return f"{payload}.{self.sign(payload.encode())}", expires
+
+    def verify(self, token):
+        """Return the user of a token that is signed by us and not expired, None otherwise."""
+        payload, _, signature = token.rpartition(".")
+        if not hmac.compare_digest(
+            self.sign(payload.encode()).encode(), signature.encode()
+        ):
+            return None
+        try:
+            user, _, expires = urlsafe_b64decode(payload).decode().rpartition(":")
+            if int(expires) < time():
+                return None
+        except ValueError:
+            return None
+        return user if user in self.users else None
@@ -0,0 +1,171 @@
+import gzip
+import json
+import os
+from hashlib import blake2b
+from json.decoder import JSONDecodeError
+from os.path import exists, join
+from re import compile
+from time import time
+
+from .store import atomic_write
+
+GUID = compile(r"^[a-f01-9]{32}$")
+
+
+def digest(data):
+    """Return the id of a backup with contents data (bytes), 32 hex digits like a uuid."""
+    return blake2b(data, digest_size=16).hexdigest()
+
+
+class BackupStore:
+    """Keeps compressed snapshots of the points in a directory, named after their contents.
+
+    A backup is stored as ID.gz, where ID is the digest of the snapshot, so a
+    snapshot that is already stored is not stored again: it only becomes the newest
+    backup. An index file records the time, size and number of points of every
+    backup. The index is read once and then only appended to, so neither listing
+    backups nor finding one needs to look at the directory.
+
+    With keep, only that many of the newest backups are kept, with days, backups
+    older than that are removed. The newest backup is never removed.
+
+    Backups made by older versions (uncompressed files with a uuid as name) are
+    added to the index when there is none yet, and keep their id.
+    """
+
+    def __init__(self, directory, keep=0, days=0):
+        self.directory = directory
+        self.keep = keep  # maximum number of backups, 0 for no maximum
+        self.days = days  # maximum age in days of a backup, 0 for no maximum
+        self.path = join(directory, "index")
+        self.entries = {}  # id -> dict with the id, file, digest, time, size and points
+        self.digests = {}  # digest of the contents -> id
+        self.lines = 0  # number of lines in the index file
+        if exists(self.path):
+            self.read()
+        else:
+            self.scan()
+            self.rewrite()
+        self.prune()
+
+    def __contains__(self, backupid):
+        return backupid in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, backupid):
+        return self.entries.get(backupid)
+
+    def read(self):
+        """Read the index, where a later line about a backup replaces an earlier one."""
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except JSONDecodeError:
+                    continue  # a partially written last line after a crash
+                self.lines += 1
+                old = self.entries.pop(entry["id"], None)
+                if old is not None:
+                    self.digests.pop(old["digest"], None)
+                if not entry.get("deleted"):
+                    self.entries[entry["id"]] = entry
+                    self.digests[entry["digest"]] = entry["id"]
+
+    def scan(self):
+        """Add the backups in the directory to the index, oldest first."""
+        found = []
+        with os.scandir(self.directory) as it:
+            for f in it:
+                name = f.name[:-3] if f.name.endswith(".gz") else f.name
+                if GUID.fullmatch(name) and f.is_file():
+                    found.append((f.stat().st_mtime, name, f.name))
+        for mtime, backupid, name in sorted(found):
+            with open(join(self.directory, name), "rb") as f:
+                data = f.read()
+            if name.endswith(".gz"):
+                data = gzip.decompress(data)
+            try:
+                points = len([k for k in json.loads(data) if k != "routes"])
+            except (TypeError, ValueError):
+                continue  # not a backup
+            entry = self.entry(backupid, name, digest(data), mtime, len(data), points)
+            self.entries[backupid] = entry
+            self.digests[entry["digest"]] = backupid
+
+    @staticmethod
+    def entry(backupid, name, digest, time, size, points):
+        return {
+            "id": backupid,
+            "file": name,
+            "digest": digest,
+            "time": time,
+            "size": size,
+            "points": points,
+        }
+
+    def append(self, entry):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.lines += 1
+
+    def rewrite(self):
+        lines = [json.dumps(entry) + "\n" for entry in self.entries.values()]
+        atomic_write(self.path, "".join(lines))
+        self.lines = len(lines)
+
+    def add(self, data, points):
+        """Store a snapshot (a str) of points points, returns a tuple (id, True if it was not stored before)."""
+        data = data.encode()
+        d = digest(data)
+        backupid = self.digests.get(d)
+        new = backupid is None
+        if new:
+            backupid = d
+            name = backupid + ".gz"
+            atomic_write(join(self.directory, name), gzip.compress(data))
+            entry = self.entry(backupid, name, d, time(), len(data), points)
+        else:  # it becomes the newest backup
+            entry = dict(self.entries.pop(backupid), time=time())
+        self.entries[backupid] = entry
+        self.digests[d] = backupid
+        self.append(entry)
+        self.prune()
+        return backupid, new
+
+    def load(self, backupid):
+        """Return the snapshot (a str) stored in a backup."""
+        name = self.entries[backupid]["file"]
+        with open(join(self.directory, name), "rb") as f:
+            data = f.read()
+        if name.endswith(".gz"):
+            data = gzip.decompress(data)
+        return data.decode()
+
+    def remove(self, backupid):
+        entry = self.entries.pop(backupid)
+        self.digests.pop(entry["digest"], None)
+        try:
+            os.remove(join(self.directory, entry["file"]))
+        except FileNotFoundError:
+            pass
+        self.append({"id": backupid, "deleted": True})
+
+    def prune(self):
+        """Remove the backups that should not be kept, and compact the index if it grew too large."""
+        ids = list(self.entries)  # oldest first
+        cutoff = time() - self.days * 86400 if self.days else None
+        for i, backupid in enumerate(ids[:-1]):
+            if (self.keep and len(ids) - i > self.keep) or (
+                cutoff is not None and self.entries[backupid]["time"] < cutoff
+            ):
+                self.remove(backupid)
+        if self.lines > 2 * len(self.entries) + 64:
+            self.rewrite()
+
+    def list(self, offset=0, limit=None):
+        """Return the entries of the backups, newest first, starting at offset."""
+        entries = list(reversed(self.entries.values()))
+        end = None if limit is None else offset + limit
+        return entries[offset:end]
@@ -0,0 +1,347 @@
+import argparse
+import http.client
+import json
+import ssl
+import subprocess
+import threading
+from base64 import b64encode
+from os import mkdir
+from os.path import exists, join
+from platform import python_version
+from tempfile import TemporaryDirectory
+from time import monotonic, perf_counter, time
+
+from . import profiles
+from .motion import Move, MotionScheduler
+from .pca9685 import PCA9685
+from .point import Point, PointCollection
+from .pool import ControllerPool
+from .server import MockPWM, RESTHandler, Server
+
+USER, PASSWORD = "bench", "bench"
+
+
+class CountingBus:
+    """Stands in for an smbus2.SMBus and only counts the transfers."""
+
+    def __init__(self):
+        self.writes = 0  # number of i2c transactions
+        self.bytes = 0  # number of register bytes written
+
+    def write_byte_data(self, address, reg, value):
+        self.writes += 1
+        self.bytes += 1
+
+    def write_i2c_block_data(self, address, reg, values):
+        self.writes += 1
+        self.bytes += len(values)
+
+    def read_byte_data(self, address, reg):
+        return 0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else None
+
+
+def selfsigned(directory):
+    """Create a self signed certificate with openssl, returns (cert, key) or None."""
+    cert, key = join(directory, "cert.pem"), join(directory, "key.pem")
+    try:
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes"]
+            + ["-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=localhost"],
+            check=True,
+            capture_output=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return cert, key
+
+
+def serve(directory, name, points, workers, context=None):
+    """Start a Server with a MockPWM and points points in a thread, returns the server.
+
+    The points are stored in name.json in directory.
+    """
+    secret = join(directory, "secret")
+    with open(secret, "w") as f:
+        f.write(f"{USER}:{PASSWORD}\n")
+    backupdir = join(directory, "backup")
+    if not exists(backupdir):
+        mkdir(backupdir)
+    pwm = MockPWM(channels=max(16, points), verbose=False)
+    server = Server(
+        ("127.0.0.1", 0),
+        RESTHandler,
+        join(directory, f"{name}.json"),
+        pwm,
+        secret,
+        backupdir,
+        join(directory, "points.log"),
+        workers=workers,
+        keepalive=15,
+    )
+    with server.lock:
+        for port in range(len(server.pc), points):
+            point = Point(port, f"Point {port}", pwm)
+            point.enable()
+            point.setspeed(4)  # moves take no more than half a second
+            server.pc[point.getindex()] = point
+    if context is not None:
+        server.socket = context.wrap_socket(
+            server.socket, server_side=True, do_handshake_on_connect=False
+        )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def client(port, context, requests, duration, latencies, errors):
+    """Send requests round robin over a single keep alive connection for duration seconds."""
+    if context is None:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    else:
+        connection = http.client.HTTPSConnection(
+            "127.0.0.1", port, timeout=10, context=context
+        )
+    auth = {
+        "Authorization": "Basic " + b64encode(f"{USER}:{PASSWORD}".encode()).decode()
+    }
+    end = monotonic() + duration
+    i = 0
+    while monotonic() < end:
+        method, path = requests[i % len(requests)]
+        i += 1
+        start = perf_counter()
+        try:
+            connection.request(method, path, headers=auth)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            connection.close()
+            continue
+        latencies.append(perf_counter() - start)
+    connection.close()
+
+
+def loadtest(server, context, requests, clients, duration):
+    """Run clients concurrent clients against server, returns a dict with the results."""
+    port = server.server_address[1]
+    latencies, errors = [], []  # list.append is atomic, so the clients can share them
+    threads = [
+        threading.Thread(
+            target=client,
+            args=(port, context, requests, duration, latencies, errors),
+        )
+        for _ in range(clients)
+    ]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": 1000 * percentile(latencies, 0.5) if latencies else None,
+        "p90_ms": 1000 * percentile(latencies, 0.9) if latencies else None,
+        "p99_ms": 1000 * percentile(latencies, 0.99) if latencies else None,
+    }
+
+
+def http_benchmarks(directory, clients, duration, workers, tls):
+    """Load test GET /points, GET /point/ID and PUT /point/ID/left, with and without TLS."""
+    results = {}
+    schemes = {"nossl": None}
+    if tls is not None:
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(certfile=tls[0], keyfile=tls[1])
+        client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        client_context.check_hostname = False
+        client_context.verify_mode = ssl.CERT_NONE
+        schemes["tls"] = (server_context, client_context)
+    else:
+        results["tls"] = "skipped, no certificate and no openssl to create one"
+    for scheme, contexts in schemes.items():
+        server = serve(directory, scheme, 16, workers, contexts and contexts[0])
+        try:
+            ids = list(server.pc)
+            tests = {
+                "GET /points": [("GET", "/points")],
+                "GET /point/ID": [("GET", f"/point/{ids[0]}")],
+                "PUT /point/ID/left": [("PUT", f"/point/{i}/left") for i in ids],
+            }
+            results[scheme] = {
+                name: loadtest(
+                    server, contexts and contexts[1], requests, clients, duration
+                )
+                for name, requests in tests.items()
+            }
+        finally:
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+def timeit(function, repeat):
+    """Return the fastest of repeat calls to function in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def serializer_benchmarks(sizes, repeat):
+    """Time PointCollection.dumps (without its cache) and loads for collections of several sizes."""
+    results = {}
+    for size in sizes:
+        pwm = MockPWM(channels=max(16, size), verbose=False)
+        pc = PointCollection(pwm=pwm)
+        for port in range(size):
+            point = Point(port, f"Point {port}", pwm)
+            pc[point.getindex()] = point
+        s = pc.dumps()
+
+        def dumps():
+            for point in pc.values():  # every point changed
+                point._json = None
+            pc.touch()
+            pc.dumps()
+
+        results[str(size)] = {
+            "bytes": len(s),
+            "dumps_ms": 1000 * timeit(dumps, repeat),
+            "loads_ms": 1000 * timeit(lambda: PointCollection.loads(s, pwm), repeat),
+        }
+    return results
+
+
+def motion_benchmark(boards, duration):
+    """Count how many moves per second the scheduler can write to a fake i2c bus.
+
+    Every point is moved back and forth across its full range. Ticks are run back
+    to back without sleeping, as if the bus and the cpu were the only limit.
+    """
+    bus = CountingBus()
+    pwm = ControllerPool([PCA9685(0x40 + i, bus=bus) for i in range(boards)])
+    points = []
+    for port in range(pwm.channels):
+        point = Point(port, f"Point {port}", pwm)
+        point.enable()
+        point.setleft(-1)
+        point.setright(1)
+        point.setprofile(("linear", "trapezoid", "scurve")[port % 3])
+        points.append(point)
+    scheduler = MotionScheduler()
+    profiles.table.cache_clear()
+    writes, written = bus.writes, bus.bytes
+    moves = ticks = 0
+    now = 0.0
+    active = []
+    start = perf_counter()
+    while perf_counter() - start < duration:
+        if not active:
+            active = [Move(p, p._right if p.current < 0 else p._left) for p in points]
+            moves += len(active)
+        scheduler.step(active, now)
+        active = [m for m in active if not m.done()]
+        now += scheduler.tick
+        ticks += 1
+    elapsed = perf_counter() - start
+    moves -= len(active)  # unfinished moves do not count
+    return {
+        "boards": boards,
+        "points": len(points),
+        "moves_per_s": moves / elapsed,
+        "ticks_per_s": ticks / elapsed,
+        "i2c_writes_per_tick": (bus.writes - writes) / ticks,
+        "i2c_bytes_per_tick": (bus.bytes - written) / ticks,
+        "tables": profiles.table.cache_info().currsize,
+        "numpy": profiles.importnumpy() is not None,
+    }
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        prog="python -m point.bench",
+        description="Benchmark the REST server, the serializer and the motion path, results are printed as JSON",
+    )
+    argparser.add_argument(
+        "-c",
+        "--clients",
+        type=int,
+        default=8,
+        help="number of concurrent clients in the load tests, default 8",
+    )
+    argparser.add_argument(
+        "-t",
+        "--duration",
+        type=float,
+        default=2.0,
+        help="seconds to run each load test and the motion benchmark, default 2",
+    )
+    argparser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=8,
+        help="number of threads that handle requests in the server, default 8",
+    )
+    argparser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=5,
+        help="number of times each serializer benchmark is repeated, the fastest counts, default 5",
+    )
+    argparser.add_argument(
+        "-b",
+        "--boards",
+        type=int,
+        default=4,
+        help="number of PCA9685 boards in the motion benchmark, default 4",
+    )
+    argparser.add_argument(
+        "--cert",
+        type=str,
+        default=None,
+        help="certificate for the TLS load tests, default a self signed certificate created with openssl",
+    )
+    argparser.add_argument(
+        "--key", type=str, default=None, help="key that goes with --cert"
+    )
+    argparser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="file to write the JSON results to, default stdout",
+    )
+    args = argparser.parse_args()
+    with TemporaryDirectory() as directory:
+        tls = (args.cert, args.key) if args.cert else selfsigned(directory)
+        results = {
+            "time": time(),
+            "python": python_version(),
+            "http": http_benchmarks(
+                directory, args.clients, args.duration, args.workers, tls
+            ),
+            "serializer": serializer_benchmarks((16, 256, 4096), args.repeat),
+            "motion": motion_benchmark(args.boards, args.duration),
+        }
+    output = json.dumps(results, indent=4)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
@@ -0,0 +1,33 @@
+from threading import Lock
+
+
+class EventHub:
+    """Distributes changes of point state to subscribers.
+
+    An event is a dict with at least an index key (the id of the point) and the
+    attributes of the point that changed. Subscribers are callables that are
+    called in the thread of the publisher, so they should return quickly.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.subscribers = ()
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers = self.subscribers + (callback,)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers = tuple(s for s in self.subscribers if s is not callback)
+
+    def publish(self, event):
+        for callback in self.subscribers:
+            callback(event)
+
+    def changed(self, index, before, after):
+        """Publish the attributes that differ between two dicts describing the same point."""
+        delta = {k: v for k, v in after.items() if before.get(k) != v}
+        if delta:
+            delta["index"] = index
+            self.publish(delta)
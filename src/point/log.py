@@ -0,0 +1,85 @@
+import json
+import os
+from email.utils import formatdate
+from queue import Empty, SimpleQueue
+from threading import Thread
+from time import time
+
+
+class LogWriter:
+    """Writes log lines to a file from a background thread.
+
+    write() only puts the message on a queue, so logging does not add to the time
+    it takes to answer a request. The background thread formats and writes
+    everything that is queued in a single write. Once the file grows beyond
+    maxbytes it is renamed to path.1 (path.1 to path.2, etc.) and a new file is
+    started, keeping at most backups old files.
+
+    Lines are either in the common log format or, if structured is True, JSON
+    objects with the time, the client, the message and any extra fields.
+    """
+
+    def __init__(self, path, maxbytes=1048576, backups=3, structured=False):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.backups = backups
+        self.structured = structured
+        self.stamp = (None, "")  # the second and its formatted timestamp
+        self.queue = SimpleQueue()
+        self.file = open(path, "a")
+        self.size = self.file.tell()
+        self.thread = Thread(target=self.run, name="log", daemon=True)
+        self.thread.start()
+
+    def write(self, message, client="-", **fields):
+        self.queue.put((time(), client, message, fields))
+
+    def close(self):
+        """Write everything that is queued and stop the background thread."""
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+    def timestamp(self, now):
+        second = int(now)
+        if self.stamp[0] != second:  # format only once per second
+            self.stamp = (second, formatdate(second, usegmt=True))
+        return self.stamp[1]
+
+    def format(self, now, client, message, fields):
+        if self.structured:
+            return (
+                json.dumps(
+                    {"time": now, "client": client, "message": message, **fields}
+                )
+                + "\n"
+            )
+        return f"{client} - - [{self.timestamp(now)}] {message}\n"
+
+    def run(self):
+        closed = False
+        while not closed:
+            batch = [self.queue.get()]
+            try:
+                while True:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            closed = None in batch
+            lines = [self.format(*entry) for entry in batch if entry is not None]
+            if lines:
+                self.file.write("".join(lines))
+                self.file.flush()
+                self.size = self.file.tell()
+                if self.size > self.maxbytes:
+                    self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "w")
+        self.size = 0
@@ -0,0 +1,128 @@
+from bisect import bisect_left
+from threading import Lock
+
+# upper bounds in seconds of the buckets of a latency histogram
+LATENCY = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def labelset(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def escape(value):
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A value that only goes up, one per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # tuple of label values -> value
+        self.lock = Lock()  # uncontended it costs less than formatting a log line
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield self.name, labelset(self.labels, labels), value
+
+
+class Histogram:
+    """Counts observations in buckets, one histogram per combination of label values."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}  # tuple of label values -> [count per bucket ..., +Inf, sum]
+        self.lock = Lock()
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = [(labels, list(counts)) for labels, counts in self.values.items()]
+        names = self.labels + ("le",)
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = labelset(names, labels + (number(bound),))
+                yield self.name + "_bucket", le, total
+            yield self.name + "_sum", labelset(self.labels, labels), counts[-1]
+            yield self.name + "_count", labelset(self.labels, labels), total
+
+
+class Collected:
+    """A metric whose value is only determined when the metrics are collected.
+
+    function returns a number, or a dict that maps a tuple of label values to a
+    number. Because nothing is done until collection, it costs nothing on the
+    path that is being measured.
+    """
+
+    def __init__(self, name, help, function, type="gauge", labels=()):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.type = type
+        self.labels = labels
+
+    def samples(self):
+        value = self.function()
+        if value is None:  # not available, for example because there is no i2c bus
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, v in value.items():
+            yield self.name, labelset(self.labels, labels), v
+
+
+class Registry:
+    """A collection of metrics that can be rendered in the Prometheus text format."""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {number(value)}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,397 @@
+import threading
+from bisect import insort
+from collections import OrderedDict
+from itertools import count
+from time import monotonic_ns, sleep, time
+from uuid import uuid4
+
+from .profiles import table
+
+
+def sleep_until(deadline):
+    """Sleep until monotonic_ns() reaches deadline, returns how late we woke up in ns."""
+    remaining = deadline - monotonic_ns()
+    if remaining > 0:
+        sleep(remaining / 1e9)
+    return monotonic_ns() - deadline
+
+
+def play(moves):
+    """Move points along precomputed tables without a scheduler, blocks until all are done.
+
+    moves is a list of (point, Table) tuples. Steps are timed against monotonic
+    deadlines, steps that are overdue are skipped.
+    """
+    if not moves:
+        return
+    period = round(min(steps.deltat for _, steps in moves) * 1e9)
+    begin = deadline = monotonic_ns()
+    while True:
+        elapsed = (monotonic_ns() - begin) / 1e9
+        done = True
+        for point, steps in moves:
+            i = steps.step(elapsed)
+            point.move(steps.position(i))
+            done = done and i == len(steps) - 1
+        if done:
+            break
+        deadline += period
+        sleep_until(deadline)
+
+
+class Timing:
+    """Jitter and overrun statistics of a loop that runs every period ns.
+
+    jitter is how late the loop woke up for a deadline, busy how long the work
+    took. A tick overruns if its work ends after the next deadline, the deadlines
+    that passed in the mean time are skipped.
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter = 0  # of the last tick
+        self.jittermax = 0
+        self.jittersum = 0
+        self.busymax = 0
+        self.busysum = 0
+
+    def record(self, jitter, busy, skipped):
+        self.ticks += 1
+        self.jitter = jitter
+        self.jittermax = max(self.jittermax, jitter)
+        self.jittersum += jitter
+        self.busymax = max(self.busymax, busy)
+        self.busysum += busy
+        if skipped:
+            self.overruns += 1
+            self.skipped += skipped
+
+    def asdict(self):
+        """Return the statistics, all times in μs."""
+        n = max(self.ticks, 1)
+        return {
+            "period": self.period / 1e3,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "jitter": self.jitter / 1e3,
+            "jittermax": self.jittermax / 1e3,
+            "jittermean": self.jittersum / n / 1e3,
+            "busymax": self.busymax / 1e3,
+            "busymean": self.busysum / n / 1e3,
+        }
+
+
+class Move:
+    """A single trajectory of a point from its current position to a target."""
+
+    def __init__(self, point, target, priority=0):
+        self.id = uuid4().hex
+        self.point = point
+        self.start = point.current
+        self.target = target
+        self.speed = point.speed
+        self.profile = point.profile
+        self.table = table(self.start, target, self.speed, point.deltat, self.profile)
+        self.priority = priority  # moves with a higher priority are started first
+        # amperes drawn while moving, a disabled servo or one that stays put draws nothing
+        self.cost = point.cost if point.enabled and target != self.start else 0.0
+        self.board = point.port // 16  # the controller the servo is on
+        # queued, running, done, failed, preempted (by another move of the point)
+        # or cancelled (because the point was deleted or replaced)
+        self.status = "queued"
+        self.created = time()
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    def done(self):
+        return self.status in ("done", "failed", "preempted", "cancelled")
+
+    def begin(self):
+        """Start from where the point is now, it may have moved since the move was created."""
+        if self.point.current != self.start:
+            point = self.point
+            self.start = point.current
+            self.table = table(
+                self.start, self.target, self.speed, point.deltat, self.profile
+            )
+
+    def index(self, now):
+        """Return the index in the table for monotonic time now (in seconds)."""
+        if self.started is None:
+            self.begin()
+            self.started = now
+        return self.table.step(now - self.started)
+
+    def asdict(self):
+        return {
+            "id": self.id,
+            "point": self.point.index,
+            "start": self.start,
+            "target": self.target,
+            "profile": self.profile,
+            "priority": self.priority,
+            "current": self.point.current,
+            "status": self.status,
+            "created": self.created,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class MotionScheduler:
+    """Runs all point trajectories in a single background thread.
+
+    Moves are submitted with submit() or submit_many() which return immediately.
+    Every tick the positions of all active moves are looked up and all changed
+    channels are flushed to the pwm controller in one go, so moving many points
+    takes as long as the slowest point.
+    Ticks are run against absolute monotonic deadlines, so the time spent in a
+    tick does not add up. If a tick takes longer than the next deadline, the
+    deadlines that passed are skipped: positions depend on the time since the
+    start of a move, so the next tick simply catches up.
+    Finished moves are remembered (up to history entries) so clients can poll their status.
+
+    A point has at most one move that is queued or running. A move to the target
+    it already moves to returns that move, a move to where an idle point already
+    is is done at once. A move to another target preempts the move of the point:
+    the new move starts from wherever the point is at the next tick and, if the
+    old move was running, takes over its place in the budget, so a burst of
+    commands for a point costs a single move.
+
+    Moving servos draw current, and too many at once can overload the power
+    supply. With a budget (in amperes, for all servos) and/or a boardbudget (for
+    the servos on a single controller) a move only starts if the cost of the
+    servo fits in what the running moves leave, otherwise it waits. Waiting
+    moves start in order of priority and then in the order they were submitted,
+    a move that does not fit holds up the moves after it (on its controller, or
+    all of them for the overall budget) so it cannot be overtaken forever. A move
+    that costs more than a budget by itself only starts when nothing else runs.
+    """
+
+    def __init__(
+        self,
+        callback=None,
+        history=256,
+        tick=0.02,
+        events=None,
+        budget=0,
+        boardbudget=0,
+    ):
+        self.callback = callback  # called with the Move when it finishes
+        # if set, an EventHub that is told about every position change
+        self.events = events
+        self.history = history
+        self.tick = tick  # seconds between updates of all active moves
+        self.timing = Timing(round(tick * 1e9))
+        self.budget = budget  # amperes for all moving servos, 0 for no limit
+        self.boardbudget = boardbudget  # amperes for the moving servos of a controller
+        self.used = 0.0  # amperes drawn by the active moves
+        self.boardused = {}  # controller -> amperes drawn by its active moves
+        self.moves = OrderedDict()
+        self.active = []
+        self.waiting = []  # sorted (-priority, number, Move) tuples
+        self.points = {}  # point -> its Move that is queued or running
+        self.submitted = count()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="motion", daemon=True)
+        self.thread.start()
+
+    def submit(self, point, target, priority=0):
+        return self.submit_many([(point, target)], priority)[0]
+
+    def submit_many(self, targets, priority=0):
+        """Start moves for a list of (point, target) tuples in the same tick, as far as the budget allows."""
+        moves = []
+        with self.condition:
+            for point, target in targets:
+                move = self.replace(point, target, priority)
+                if move is None:
+                    move = Move(point, target, priority)
+                    if target == point.current:
+                        move.status = "done"
+                        move.finished = time()
+                    else:
+                        insort(self.waiting, (-priority, next(self.submitted), move))
+                        self.points[point] = move
+                if move.id not in self.moves:
+                    self.moves[move.id] = move
+                moves.append(move)
+            while len(self.moves) > self.history:
+                self.moves.popitem(last=False)
+            self.admit()
+            self.condition.notify()
+        return moves
+
+    def replace(self, point, target, priority):
+        """Return the move of point to target that replaces the move it has, or None, with the condition held.
+
+        The move it has is returned as is if it has the same target.
+        """
+        old = self.points.get(point)
+        if old is None or old.done():
+            return None
+        if old.target == target:
+            return old
+        move = Move(point, target, max(priority, old.priority))
+        self.end(old, "preempted")
+        self.points[point] = move
+        entry = self.unqueue(old)
+        if entry is not None:  # it was waiting, the new move takes its place
+            insort(self.waiting, (-move.priority, entry[1], move))
+        else:  # it was admitted, the new move continues on its budget
+            move.cost, old.cost = old.cost, 0.0
+            self.active.append(move)
+        return move
+
+    def end(self, move, status):
+        move.status = status
+        move.finished = time()
+
+    def unqueue(self, move):
+        """Remove a move from the waiting moves and return its entry, None if it is not waiting."""
+        for i, entry in enumerate(self.waiting):
+            if entry[2] is move:
+                del self.waiting[i]
+                return entry
+        return None
+
+    def cancel(self, points):
+        """End the moves of points that are deleted or replaced, so they no longer drive their port."""
+        with self.condition:
+            for point in points:
+                move = self.points.pop(point, None)
+                if move is not None and not move.done():
+                    self.end(move, "cancelled")
+                    self.unqueue(move)  # an admitted move is released by finish()
+            self.admit()
+
+    def fits(self, used, budget, cost):
+        return not budget or not used or used + cost <= budget + 1e-9
+
+    def admit(self):
+        """Move waiting moves to the active ones as far as the budget allows, with the condition held."""
+        blocked = set()  # controllers with a move that has to wait
+        started = []
+        for entry in self.waiting:
+            move = entry[2]
+            if move.cost:
+                if move.board in blocked:
+                    continue
+                if not self.fits(self.used, self.budget, move.cost):
+                    break
+                used = self.boardused.get(move.board, 0.0)
+                if not self.fits(used, self.boardbudget, move.cost):
+                    blocked.add(move.board)
+                    continue
+                self.used += move.cost
+                self.boardused[move.board] = used + move.cost
+            started.append(entry)
+        for entry in started:
+            self.waiting.remove(entry)
+            self.active.append(entry[2])
+
+    def release(self, moves):
+        """Give back the budget of moves that ended, with the condition held."""
+        for move in moves:
+            if move.cost:
+                self.used = max(0.0, self.used - move.cost)
+                self.boardused[move.board] -= move.cost
+            if self.points.get(move.point) is move:
+                del self.points[move.point]
+        self.admit()
+
+    def waitingcount(self):
+        with self.condition:
+            return len(self.waiting)
+
+    def get(self, moveid):
+        return self.moves.get(moveid)
+
+    def inflight(self):
+        with self.condition:
+            return sum(not m.done() for m in self.active) + len(self.waiting)
+
+    def run(self):
+        period = self.timing.period
+        deadline = None
+        while True:
+            with self.condition:
+                if not self.active:
+                    deadline = None
+                while not self.active:
+                    self.condition.wait()
+                active = list(self.active)
+            if deadline is None:  # the first tick after being idle starts right away
+                deadline = monotonic_ns()
+            jitter = sleep_until(deadline)
+            start = monotonic_ns()
+            self.step(active, start / 1e9)
+            self.finish()
+            end = monotonic_ns()
+            deadline += period
+            skipped = (end - deadline) // period + 1 if end > deadline else 0
+            deadline += skipped * period
+            self.timing.record(jitter, end - start, skipped)
+
+    def finish(self):
+        """Remove the moves that ended from the active ones and give back their budget."""
+        with self.condition:
+            finished = [m for m in self.active if m.done()]
+            if finished:
+                self.active = [m for m in self.active if not m.done()]
+                self.release(finished)
+        if self.callback is not None:
+            for move in finished:
+                self.callback(move)
+
+    def step(self, moves, now):
+        """Advance all moves to time now and write all changed channels per controller."""
+        values = {}  # id(pwm) -> (pwm, {port: 12-bit register value})
+        changed = []
+        arrived = set()  # moves that reached their target
+        for move in moves:
+            if move.done():  # preempted or cancelled since the tick started
+                continue
+            point = move.point
+            i = move.index(now)
+            position = move.table.position(i)
+            if point.enabled and position != point.current:
+                pwm = point.pwm
+                channels = values.setdefault(id(pwm), (pwm, {}))[1]
+                channels[point.port] = move.table.value(i)
+                point.current = position
+                changed.append(point)
+            if i == len(move.table) - 1:
+                arrived.add(move)
+        errors = {}  # move -> error of its controller
+        for pwm, channels in values.values():
+            try:
+                if hasattr(pwm, "setServoValues"):
+                    pwm.setServoValues(channels)
+                else:  # the pulse width in the middle of the range that maps to value
+                    for port, value in channels.items():
+                        pwm.setServoPulse(port, (value + 0.5) * 20000 / 4096)
+            except Exception as e:  # a failing controller should not stop the scheduler
+                for move in moves:
+                    if move.point.pwm is pwm and move.point.port in channels:
+                        errors[move] = str(e)
+        # a move that was preempted or cancelled during the tick keeps that status
+        with self.condition:
+            for move in moves:
+                if move.done():
+                    continue
+                if move in errors:
+                    move.error = errors[move]
+                    self.end(move, "failed")
+                elif move in arrived:
+                    self.end(move, "done")
+                else:
+                    move.status = "running"
+        if self.events is not None:
+            for point in changed:
+                self.events.publish({"index": point.index, "current": point.current})
@@ -6,8 +6,6 @@
 import math
 import time
 
-import smbus2 as smbus
-
 # ============================================================================
 # Raspi PCA9685 16-Channel PWM Servo Driver
 # ============================================================================
@@ -29,24 +27,96 @@ class PCA9685:
     __ALLLED_ON_H = 0xFB
     __ALLLED_OFF_L = 0xFC
     __ALLLED_OFF_H = 0xFD
+    __MODE2 = 0x01
+    __LED15_OFF_H = 0x45
+    __AI = 0x20  # MODE1 auto-increment bit
+    __RESTART = 0x80  # MODE1 restart bit, it always reads back as 0 after writing
+    __BLOCK = 32  # maximum number of bytes in a single i2c block write
+
+    def __init__(self, address=0x40, debug=False, bus=None):
+        # several controllers on the same i2c bus may share a single bus object
+        if bus is None:
+            import smbus2 as smbus
 
-    def __init__(self, address=0x40, debug=False):
-        self.bus = smbus.SMBus(1)
+            bus = smbus.SMBus(1)
+        self.bus = bus
         self.address = address
         self.debug = debug
+        self.shadow = {}  # last known values of the MODE, PRESCALE and LED registers
+        # number of register writes skipped because the value was unchanged
+        self.saved = 0
+        self.transactions = 0  # number of i2c transactions
+        self.transferred = 0  # number of register bytes read or written
         if self.debug:
             print("Reseting PCA9685")
-        self.write(self.__MODE1, 0x00)
+        self.write(self.__MODE1, self.__AI)
+
+    def shadowed(self, reg):
+        return (
+            reg in (self.__MODE1, self.__MODE2, self.__PRESCALE)
+            or self.__LED0_ON_L <= reg <= self.__LED15_OFF_H
+        )
+
+    def remember(self, reg, value):
+        if reg == self.__MODE1:
+            value &= ~self.__RESTART & 0xFF
+        if self.shadowed(reg):
+            self.shadow[reg] = value
+        elif self.__ALLLED_ON_L <= reg <= self.__ALLLED_OFF_H:
+            # a write to an ALL_LED register sets the same register of every channel
+            for channel in range(16):
+                self.shadow[
+                    self.__LED0_ON_L + 4 * channel + reg - self.__ALLLED_ON_L
+                ] = value
+
+    def invalidate(self):
+        "Forget all cached register values, for example after the controller was reset by something else"
+        self.shadow.clear()
 
     def write(self, reg, value):
         "Writes an 8-bit value to the specified register/address"
+        if self.shadow.get(reg) == value:
+            self.saved += 1
+            return
         self.bus.write_byte_data(self.address, reg, value)
+        self.transactions += 1
+        self.transferred += 1
+        self.remember(reg, value)
         if self.debug:
             print("I2C: Write 0x%02X to register 0x%02X" % (value, reg))
 
+    def writeBlock(self, reg, values):
+        "Writes a list of 8-bit values to consecutive registers starting at the specified register"
+        # only write the part between the first and the last changed register
+        first, last = 0, len(values)
+        while first < last and self.shadow.get(reg + first) == values[first]:
+            first += 1
+        while last > first and self.shadow.get(reg + last - 1) == values[last - 1]:
+            last -= 1
+        self.saved += len(values) - (last - first)
+        if first == last:
+            return
+        reg, values = reg + first, values[first:last]
+        self.bus.write_i2c_block_data(self.address, reg, values)
+        self.transactions += 1
+        self.transferred += len(values)
+        for i, value in enumerate(values):
+            self.remember(reg + i, value)
+        if self.debug:
+            print(
+                "I2C: Write %s to registers 0x%02X-0x%02X"
+                % (" ".join("0x%02X" % v for v in values), reg, reg + len(values) - 1)
+            )
+
     def read(self, reg):
         "Read an unsigned byte from the I2C device"
+        if reg in self.shadow:
+            return self.shadow[reg]
         result = self.bus.read_byte_data(self.address, reg)
+        self.transactions += 1
+        self.transferred += 1
+        if self.shadowed(reg):
+            self.remember(reg, result)
         if self.debug:
             print(
                 "I2C: Device 0x%02X returned 0x%02X from reg 0x%02X"
@@ -54,6 +124,42 @@ class PCA9685:
             )
         return result
 
+    def readBlock(self, reg, length):
+        "Read consecutive registers starting at the specified register, in as few transfers as possible"
+        values = []
+        for start in range(reg, reg + length, self.__BLOCK):
+            n = min(self.__BLOCK, reg + length - start)
+            values.extend(self.bus.read_i2c_block_data(self.address, start, n))
+            self.transactions += 1
+            self.transferred += n
+        for i, value in enumerate(values):
+            if self.shadowed(reg + i):
+                self.remember(reg + i, value)
+        if self.debug:
+            print(
+                "I2C: Device 0x%02X returned %s from registers 0x%02X-0x%02X"
+                % (
+                    self.address,
+                    " ".join("0x%02X" % v for v in values),
+                    reg,
+                    reg + length - 1,
+                )
+            )
+        return values
+
+    def readServoValues(self):
+        "Returns a dict channel -> 12-bit pulse length of every channel that outputs a pulse, as read back from the controller"
+        registers = self.readBlock(self.__LED0_ON_L, 64)
+        values = {}
+        for channel in range(16):
+            on_l, on_h, off_l, off_h = registers[4 * channel : 4 * channel + 4]
+            if (on_h | off_h) & 0x10:  # full on or full off, not a servo pulse
+                continue
+            values[channel] = (
+                ((off_h & 0x0F) << 8 | off_l) - ((on_h & 0x0F) << 8 | on_l)
+            ) % 4096
+        return values
+
     def setPWMFreq(self, freq):
         "Sets the PWM frequency"
         prescaleval = 25000000.0  # 25MHz
@@ -68,23 +174,83 @@ class PCA9685:
             print("Final pre-scale: %d" % prescale)
 
         oldmode = self.read(self.__MODE1)
+        # already running at this frequency, for example after a restart of the server:
+        # putting the oscillator to sleep would interrupt the pulses
+        if not oldmode & 0x10 and self.read(self.__PRESCALE) == prescale:
+            return
         newmode = (oldmode & 0x7F) | 0x10  # sleep
         self.write(self.__MODE1, newmode)  # go to sleep
         self.write(self.__PRESCALE, int(math.floor(prescale)))
         self.write(self.__MODE1, oldmode)
-        time.sleep(0.005)
+        time.sleep(0.0005)  # the oscillator takes at most 500 μs to start
         self.write(self.__MODE1, oldmode | 0x80)
 
     def setPWM(self, channel, on, off):
         "Sets a single PWM channel"
-        self.write(self.__LED0_ON_L + 4 * channel, on & 0xFF)
-        self.write(self.__LED0_ON_H + 4 * channel, on >> 8)
-        self.write(self.__LED0_OFF_L + 4 * channel, off & 0xFF)
-        self.write(self.__LED0_OFF_H + 4 * channel, off >> 8)
+        self.writeBlock(
+            self.__LED0_ON_L + 4 * channel, [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+        )
         if self.debug:
             print("channel: %d  LED_ON: %d LED_OFF: %d" % (channel, on, off))
 
+    def setPWMs(self, channels):
+        "Sets several PWM channels, channels maps a channel to an (on, off) tuple"
+        # consecutive channels are written in a single block transfer
+        run = []
+        for channel in sorted(channels):
+            if run and (channel != run[-1] + 1 or 4 * (len(run) + 1) > self.__BLOCK):
+                self.__writeRun(run, channels)
+                run = []
+            run.append(channel)
+        if run:
+            self.__writeRun(run, channels)
+
+    def __writeRun(self, run, channels):
+        values = []
+        for channel in run:
+            on, off = channels[channel]
+            values.extend((on & 0xFF, on >> 8, off & 0xFF, off >> 8))
+        self.writeBlock(self.__LED0_ON_L + 4 * run[0], values)
+
+    def setAllPWM(self, on, off):
+        "Sets all PWM channels to the same value with a single broadcast write"
+        values = [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+        if all(
+            self.shadow.get(self.__LED0_ON_L + 4 * channel + i) == v
+            for channel in range(16)
+            for i, v in enumerate(values)
+        ):
+            self.saved += 64
+            return
+        self.writeBlock(self.__ALLLED_ON_L, values)
+
+    @staticmethod
+    def pulseValue(pulse):
+        "Converts a pulse width in μs to a 12-bit register value, the PWM frequency must be 50HZ"
+        return int(pulse * 4096 / 20000)  # PWM frequency is 50HZ,the period is 20000us
+
     def setServoPulse(self, channel, pulse):
         "Sets the Servo Pulse,The PWM frequency must be 50HZ"
-        pulse = pulse * 4096 / 20000  # PWM frequency is 50HZ,the period is 20000us
-        self.setPWM(channel, 0, int(pulse))
+        self.setPWM(channel, 0, self.pulseValue(pulse))
+
+    def setServoPulses(self, pulses):
+        "Sets the Servo Pulse of several channels, pulses maps a channel to a pulse width"
+        self.setServoValues(
+            {channel: self.pulseValue(pulse) for channel, pulse in pulses.items()}
+        )
+
+    def setServoValue(self, channel, value):
+        "Sets the Servo Pulse of a channel to a precomputed 12-bit register value"
+        self.setPWM(channel, 0, value)
+
+    def setServoValues(self, values):
+        "Sets the Servo Pulse of several channels, values maps a channel to a 12-bit register value"
+        same = set(values.values())
+        if len(values) == 16 and len(same) == 1:  # all channels the same: broadcast
+            self.setAllPWM(0, same.pop())
+            return
+        self.setPWMs({channel: (0, value) for channel, value in values.items()})
+
+    def setAllServoPulse(self, pulse):
+        "Sets the Servo Pulse of all channels"
+        self.setAllPWM(0, self.pulseValue(pulse))
@@ -1,8 +1,16 @@
 import json
 from collections import OrderedDict
-from time import sleep, time
+from itertools import count
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter
+from time import time
 from uuid import uuid4
 
+from .motion import play
+from . import profiles
+from .profiles import Profiles, table
+from .routes import Route, RouteTable
+
 Position = {"left", "right", "mid"}
 PointType = {
     "left",
@@ -13,39 +21,175 @@ PointType = {
     "double",
     "triple",
 }
+Transient = {"current"}  # attributes that change too often to be worth persisting
+# commands that change the configuration of a point and that may be replayed from the journal
+Journaled = {
+    "enable",
+    "disable",
+    "save",
+    "setleft",
+    "setright",
+    "setmid",
+    "setdeltat",
+    "setspeed",
+    "setport",
+    "setpointtype",
+    "setdefault",
+    "setdescription",
+    "setprofile",
+    "setcost",
+}
+
+
+def number(low, high, name):
+    """Return a check for numbers within [low, high]."""
+
+    def check(value, pwm):
+        if type(value) is not float:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{name} is not a number")
+        if not low <= value <= high:  # also false for nan
+            raise ValueError(f"{name} not in range [{low}, {high}]")
+        return value
+
+    check.bounds = (low, high)  # lets codec() skip the call for values that are fine
+    return check
+
+
+def choice(choices, name):
+    """Return a check for values that should be one of choices."""
+
+    def check(value, pwm):
+        if not isinstance(value, str) or value not in choices:
+            raise ValueError(f"{name} not one of {choices}")
+        return value
+
+    check.choices = choices  # lets codec() skip the call for values that are fine
+    return check
+
+
+def string(name, clean=lambda s: s[:1024]):
+    """Return a check for strings, that are cleaned up before use."""
+
+    def check(value, pwm):
+        if not isinstance(value, str):
+            raise ValueError(f"{name} is not a string")
+        return clean(value)
+
+    return check
+
+
+def clamp(value):
+    """Return value as a position within [-1, 1], 0 for values that are not numbers (or nan)."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return min(max(value, -1.0), 1.0) if value == value else 0.0
+
+
+def checkindex(value, pwm):
+    if not isinstance(value, str) or not value:
+        raise ValueError("index is not a non empty string")
+    return value
+
+
+def checkport(value, pwm):
+    if isinstance(value, bool):
+        raise ValueError("port is not an integer")
+    try:
+        p = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("port is not an integer")
+    n = getattr(pwm, "channels", 16)
+    if p < 0 or p >= n:
+        raise ValueError(f"port not in range [0,{n - 1}]")
+    return p
+
+
+def checkenabled(value, pwm):
+    if not isinstance(value, bool):
+        raise ValueError("enabled is not a boolean")
+    return value
+
+
+# the attributes that make up the JSON representation of a point, in order,
+# with their default value, the function that checks and converts a new value
+# and their JSON type (str, int, float or bool)
+Schema = {
+    "index": (None, checkindex, str),  # a new uuid
+    "port": (0, checkport, int),
+    "name": (None, string("name"), str),  # based on the port
+    "enabled": (False, checkenabled, bool),
+    "current": (0.0, number(-1, 1, "current"), float),  # range [-1.0, 1.0]
+    "description": (
+        "A point",
+        string("description", lambda s: s[:1024].strip().expandtabs(4)),
+        str,
+    ),
+    "_left": (0.0, number(-1, 1, "pos"), float),  # range [-1.0, 1.0]
+    "_right": (0.0, number(-1, 1, "pos"), float),  # range [-1.0, 1.0]
+    "_mid": (0.0, number(-1, 1, "pos"), float),  # range [-1.0, 1.0]
+    # change in position per second when changing position (default is 4 seconds to travel from full left to right)
+    "speed": (0.5, number(0.05, 4, "speed"), float),
+    "default": ("left", choice(Position, "default"), str),  # left, right, mid
+    # seconds between micro steps
+    "deltat": (0.02, number(0.005, 0.1, "deltat"), float),
+    "pointtype": ("left", choice(PointType, "type"), str),
+    # how the speed changes during a move: linear, trapezoid or scurve
+    "profile": ("linear", choice(Profiles, "profile"), str),
+    # estimated current in amperes the servo draws while it moves, see MotionScheduler
+    "cost": (0.5, number(0, 10, "cost"), float),
+}
+Fields = tuple(Schema)
+_values = attrgetter(*Fields)
+_versions = count(1)  # versions of the attributes of points, see Point.dumps()
 
 
 class Point:
+    __slots__ = Fields + ("pwm", "scheduler", "_owner", "_json", "_version")
+
     def __init__(self, port, name, pwm=None, default="left", pointtype="left"):
-        self.index = uuid4().hex
-        self.setport(port)
-        self.name = name if name else f"Point on port {port}"
         self.setpwm(pwm)
-        self.enabled = False
-        self._mid = 0.0  # range [-1.0, 1.0]
-        self._left = 0.0  # range [-1.0, 1.0]
-        self._right = 0.0  # range [-1.0, 1.0]
-        self.speed = 0.5  # change in position per second when changing position (default is 4 seconds to travel from full left to right)
-        self.setdefault(default)  # left, right, mid
-        self.current = 0.0  # range [-1.0, 1.0]
-        self.deltat = 0.02  # seconds between micro steps
-        self.setpointtype(pointtype)
-        self.description = "A point"
+        # if set, moveleft/moveright are handed to this MotionScheduler
+        self.scheduler = None
+        self._owner = None  # the PointCollection that is told about every change
+        self._json = None  # cached (version, result) of dumps()
+        self._version = None  # changes with every change to an attribute
+        values = Point.decode(
+            {"port": port, "name": name, "default": default, "pointtype": pointtype},
+            pwm,
+        )
+        for k, v in zip(Fields, values):
+            object.__setattr__(self, k, v)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in Schema:
+            # a new version instead of clearing _json, which dumps() may be about
+            # to set with what it encoded before this change (current is changed
+            # by the motion thread)
+            object.__setattr__(self, "_version", next(_versions))
+            if self._owner is not None:
+                self._owner.touch()
+
+    def set(self, name, value):
+        """Check and set one of the attributes in the Schema."""
+        setattr(self, name, Schema[name][1](value, self.pwm))
 
     def getindex(self):
         return self.index
 
     def setport(self, port):
-        p = int(port)
-        if p < 0 or p > 15:
-            raise ValueError("port not in range [0,15]")
-        self.port = p
+        self.set("port", port)
 
     def getport(self):
         return self.port
 
     def setname(self, name):
-        self.name = name
+        self.set("name", name)
 
     def getname(self):
         return self.name
@@ -58,103 +202,105 @@ class Point:
     # there is no getpwm
 
     def setdefault(self, default):
-        if default not in Position:
-            raise ValueError(f"default not one of {Position}")
-        self.default = default
+        self.set("default", default)
 
     def getdefault(self):
         return self.default
 
     def setspeed(self, speed):
-        if speed < 0.05 or speed > 4:
-            raise ValueError("speed not in range [0.05, 4]")
-        self.speed = speed
+        self.set("speed", speed)
 
     def getspeed(self):
         return self.speed
 
     def setdeltat(self, deltat):
-        if deltat < 0.005 or deltat > 0.1:
-            raise ValueError("deltat not in range [0.005, 0.1]")
-        self.deltat = deltat
+        self.set("deltat", deltat)
 
     def getdeltat(self):
         return self.deltat
 
     # actions that move the point
     def movemid(self):
-        self.move(self._mid)
+        return self.goto(self._mid)
 
     def moveleft(self):
-        self.position(self.current, self._left, self.speed)
+        return self.goto(self._left)
 
     def moveright(self):
-        self.position(self.current, self._right, self.speed)
+        return self.goto(self._right)
 
     def movestart(self):
-        self.move(self._left if self.default == "left" else self._right)
+        return self.goto(self.target(self.default))
+
+    def goto(self, target):
+        """Move to target, returns a Move if a scheduler is present, otherwise blocks until done."""
+        target = Schema["_mid"][1](target, self.pwm)
+        if self.scheduler is not None:
+            return self.scheduler.submit(self, target)
+        if target != self.current:
+            self.position(self.current, target, self.speed)
 
     def position(self, start, end, speed):
-        if start > end:
-            speed = -speed
-        stepsize = speed * self.deltat
-        steps = int((end - start) / stepsize)
-        print(f"{start=} {end=} {steps=} {stepsize=}")
-        for _ in range(steps):
-            self.delay()
-            self.move(start)
-            self.delay()
-            start += stepsize
-        self.move(end)
-
-    def delay(self):
-        sleep(self.deltat)
+        """Move from start to end, blocks until done."""
+        play([(self, table(start, end, speed, self.deltat, self.profile))])
+
+    @staticmethod
+    def pulse(position):
+        return (
+            (position + 1.0) / 2.0
+        ) * 2000 + 500  # map [-1, 1] -> [500, 2500] i.e. 0.5 to 2.5 μs
 
     def move(self, position):
+        position = Schema["current"][1](position, self.pwm)
         if self.enabled:
-            p = (
-                (position + 1.0) / 2.0
-            ) * 2000 + 500  # map [-1, 1] -> [500, 2500] i.e. 0.5 to 2.5 μs
-            self.pwm.setServoPulse(self.port, p)
+            self.pwm.setServoPulse(self.port, self.pulse(position))
             self.current = position
 
+    def target(self, position):
+        """Return the numeric target for a named position or a number."""
+        if position in Position:
+            return getattr(self, "_" + position)
+        return Schema["_mid"][1](position, self.pwm)
+
     # set.get configuration
     def enable(self):
         self.enabled = True
 
-    def enabled(self):
+    def isenabled(self):
         return self.enabled
 
     def disable(self):
         self.enabled = False
 
+    def setenabled(self, enabled):
+        self.set("enabled", enabled)
+
+    def getcurrent(self):
+        return self.current
+
+    def setcurrent(self, pos):
+        self.set("current", pos)
+
     def getmid(self):
         return self._mid
 
     def setmid(self, pos):
-        if pos < -1 or pos > 1:
-            raise ValueError("pos not in range [-1, 1]")
-        self._mid = pos
+        self.set("_mid", pos)
 
     def getleft(self):
         return self._left
 
     def setleft(self, pos):
-        if pos < -1 or pos > 1:
-            raise ValueError("pos not in range [-1, 1]")
-        self._left = pos
+        self.set("_left", pos)
 
     def getright(self):
         return self._right
 
     def setright(self, pos):
-        if pos < -1 or pos > 1:
-            raise ValueError("pos not in range [-1, 1]")
-        self._right = pos
+        self.set("_right", pos)
 
     def setdescription(self, s):
-        s = json.dumps(s[:1024].strip().expandtabs(4))[1:-1]
-        self.description = s
+        self.set("description", s)
 
     def getdescription(self):
         return self.description
@@ -163,59 +309,449 @@ class Point:
         return self.pointtype
 
     def setpointtype(self, t):
-        if t not in PointType:
-            raise ValueError(f"type not one of {PointType}")
-        self.pointtype = t
+        self.set("pointtype", t)
+
+    def getprofile(self):
+        return self.profile
+
+    def setprofile(self, profile):
+        self.set("profile", profile)
+
+    def getcost(self):
+        return self.cost
+
+    def setcost(self, cost):
+        self.set("cost", cost)
 
     def __repr__(self):
         return f'Point({self.port},"{self.name}",{self.pwm=},default="{self.default})'
 
+    def asdict(self):
+        return dict(zip(Fields, _values(self)))
+
     def dumps(self):
-        return f"""{{"index": "{self.index}", "port":{self.port}, "name":"{self.name}", "enabled":{"true" if self.enabled else "false"}, "current":{self.current:.5f}, "description":"{self.description}","_left":{self._left:.5f}, "_right":{self._right:.5f}, "_mid":{self._mid:.5f}, "speed":{self.speed:.5f}, "default":"{self.default}", "deltat":{self.deltat:.5f}, "pointtype":"{self.pointtype}"}}"""
+        cached, version = self._json, self._version
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        text = _encode(self)
+        object.__setattr__(self, "_json", (version, text))
+        return text
 
     @staticmethod
-    def loads(s) -> "Point":
+    def loads(s, pwm) -> "Point":
         d = json.loads(s)
-        return Point.loadd(d)
+        return Point.loadd(d, pwm)
+
+    @staticmethod
+    def decode(d, pwm):
+        """Check the attributes in dict d and return a list with a value for every field.
+
+        Missing attributes get their default value.
+        Raises a ValueError if d contains unknown attributes or values out of range.
+        """
+        values = _decode(d, pwm)
+        if values[0] is None:
+            values[0] = uuid4().hex
+        if values[2] is None:
+            values[2] = f"Point on port {values[1]}"
+        return values
 
     @staticmethod
     def loadd(d, pwm) -> "Point":
-        p = Point(d["port"], d["name"], pwm)
-        p.__dict__.update(d)
+        """Create a point from a dict, see decode().
+
+        current is only what the point was last set to, a value that is out of
+        range (written by older versions) is clamped instead of refused.
+        """
+        current = d.get("current") if isinstance(d, dict) else None
+        if current is not None and not (type(current) is float and -1 <= current <= 1):
+            d = dict(d, current=clamp(current))
+        p = _load(d, pwm)
+        if p.index is None:
+            object.__setattr__(p, "index", uuid4().hex)
+        if p.name is None:
+            object.__setattr__(p, "name", f"Point on port {p.port}")
         return p
 
     def save(self, d):
-        """Note that this function will update fields without any bounds checking!"""
-        self.__dict__.update(d)
+        """Update attributes from a dict, either all of them or none.
+
+        Raises a ValueError if d contains unknown attributes or values out of range.
+        """
+        values = _decode(d, self.pwm)
+        if d.get("index", self.index) != self.index:
+            raise ValueError("index cannot be changed")
+        for k, v in zip(Fields, values):
+            if k in d:
+                setattr(self, k, v)
+
+
+def codec(cls, schema):
+    """Generate the functions that convert between instances of cls and JSON.
+
+    Returns a tuple (encode, decode, load):
+    encode(p) returns the JSON text of p in a single f-string.
+    decode(d, pwm) checks every attribute in dict d once and returns a list with a
+    value for every field in schema order, missing attributes get their default.
+    load(d, pwm) does the same but stores the values directly in the slots of a new
+    instance of cls, with its other slots set to None.
+    All three are compiled from the schema so they cannot drift apart.
+    """
+    env = {
+        "quote": encode_basestring_ascii,
+        "boolean": {True: "true", False: "false"},
+        "Schema": schema,
+        "new": cls.__new__,
+        "cls": cls,
+    }
+    parts, values = [], []
+    for i, (k, (default, check, kind)) in enumerate(schema.items()):
+        env[f"check{i}"], env[f"default{i}"] = check, default
+        key = json.dumps(k).replace("{", "{{").replace("}", "}}")
+        if kind is str:
+            parts.append(f"{key}: {{quote(p.{k})}}")
+        elif kind is bool:
+            parts.append(f"{key}: {{boolean[p.{k}]}}")
+        else:  # for numbers repr() gives the same result as the json module
+            parts.append(f"{key}: {{p.{k}!r}}")
+        get = f"(v := get({k!r}))"
+        fallback = f"default{i} if v is None else check{i}(v, pwm)"
+        if hasattr(check, "bounds"):  # the check is only called for unusual values
+            env[f"low{i}"], env[f"high{i}"] = check.bounds
+            value = (
+                f"v if type{get} is float and low{i} <= v <= high{i} else ({fallback})"
+            )
+        elif hasattr(check, "choices"):
+            env[f"choices{i}"] = check.choices
+            value = f"v if type{get} is str and v in choices{i} else ({fallback})"
+        else:
+            value = f"default{i} if {get} is None else check{i}(v, pwm)"
+        values.append(value)
+    stores = []
+    for i, k in enumerate(cls.__slots__):
+        env[f"set{i}"] = getattr(cls, k).__set__  # bypasses cls.__setattr__
+        value = values[i] if i < len(values) else "pwm" if k == "pwm" else "None"
+        stores.append(f"    set{i}(p, {value})\n")
+    check = (
+        "    if not isinstance(d, dict):\n"
+        "        raise ValueError('point is not an object')\n"
+        "    if not d.keys() <= Schema.keys():\n"
+        "        unknown = ', '.join(sorted(d.keys() - Schema.keys()))\n"
+        "        raise ValueError(f'unknown attribute {unknown}')\n"
+        "    get = d.get\n"
+    )
+    source = (
+        "def encode(p):\n"
+        f"    return f'{{{{{', '.join(parts)}}}}}'\n"
+        "def decode(d, pwm):\n"
+        + check
+        + "    return [\n"
+        + "".join(f"        {value},\n" for value in values)
+        + "    ]\n"
+        "def load(d, pwm):\n"
+        + check
+        + "    p = new(cls)\n"
+        + "".join(stores)
+        + "    return p\n"
+    )
+    exec(compile(source, f"<{cls.__name__} codec>", "exec"), env)
+    return env["encode"], env["decode"], env["load"]
+
+
+_encode, _decode, _load = codec(Point, Schema)
+
+
+class BatchError(ValueError):
+    """A command in a batch failed, position is its place in the batch."""
+
+    def __init__(self, position, message):
+        super().__init__(message)
+        self.position = position
 
 
 class PointCollection(OrderedDict):
-    def __init__(self, *args, pwm=None, **kwargs):
-        super().__init__(*args, **kwargs)
+    """An ordered collection of points, indexed by their id.
+
+    The collection keeps a version number that changes whenever a point is added,
+    removed or changed, and caches its serialized form (and some derived data)
+    per version. etag() combines the version with an id unique to this collection.
+    """
+
+    def __init__(self, *args, pwm=None, scheduler=None, **kwargs):
+        self.uid = uuid4().hex[:8]
+        self.counter = count(1)  # next() on a count is atomic, so no lock is needed
+        self.version = 0
+        self.cache = {}  # key -> (version, value)
         self.pwm = pwm
-        for p in self.values():
-            p.pwm = self.pwm
+        self.scheduler = scheduler
+        self.routes = RouteTable()
+        super().__init__(*args, **kwargs)
         self.start_time = time()
 
     def __setitem__(self, __k: str, __v: Point) -> None:
-        __v.pwm = self.pwm
-        return super().__setitem__(__k, __v)
+        object.__setattr__(__v, "pwm", self.pwm)
+        object.__setattr__(__v, "scheduler", self.scheduler)
+        object.__setattr__(__v, "_owner", self)
+        super().__setitem__(__k, __v)
+        self.touch()
+
+    def __delitem__(self, __k: str) -> None:
+        self[__k]._owner = None
+        super().__delitem__(__k)
+        self.cache.pop(("point", __k), None)
+        self.touch()
+
+    def pop(self, __k, *default):
+        if __k in self:
+            self[__k]._owner = None
+        value = super().pop(__k, *default)
+        self.cache.pop(("point", __k), None)
+        self.touch()
+        return value
+
+    def clear(self):
+        for p in self.values():
+            p._owner = None
+        super().clear()
+        self.cache.clear()
+        self.touch()
+
+    def touch(self):
+        self.version = next(self.counter)
+
+    def etag(self):
+        return f'"{self.uid}-{self.version}"'
+
+    def cached(self, key, compute):
+        """Return the value of compute() for the current version, computing it only once."""
+        version = self.version
+        hit = self.cache.get(key)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+        value = compute()
+        self.cache[key] = (version, value)
+        return value
+
+    def setscheduler(self, scheduler):
+        self.scheduler = scheduler
+        for p in self.values():
+            p.scheduler = scheduler
 
     def dumps(self):
-        return "{" + ",".join([f'"{k}":{v.dumps()}' for k, v in self.items()]) + "}"
+        """Return the JSON text of the points and, if there are any, the routes."""
+        return self.cached("dumps", self._dumps)
+
+    def _dumps(self):
+        points = self.cached("points", self._points)
+        if not self.routes:
+            return points
+        routes = json.dumps(self.routes.asdict())
+        return f'{points[:-1]}{"," if len(self) else ""}"routes":{routes}}}'
+
+    def _points(self):
+        points = [f"{encode_basestring_ascii(k)}:{v.dumps()}" for k, v in self.items()]
+        return "{" + ",".join(points) + "}"
+
+    def encoded(self):
+        """Return the JSON text of the points, without the routes, as bytes."""
+        return self.cached(
+            "encoded", lambda: self.cached("points", self._points).encode()
+        )
+
+    def encodedpoint(self, index):
+        """Return the JSON bytes of a point together with the list of free ports."""
+
+        def compute():
+            point = self[index].dumps()
+            freeports = json.dumps(self.freeportlist())
+            return f'{{"point": {point}, "freeports": {freeports}}}'.encode()
+
+        return self.cached(("point", index), compute)
 
     @staticmethod
     def loads(s, pwm):
         d = json.loads(s)
         pc = PointCollection(pwm=pwm)
-        for index, point in d.items():
-            pc[index] = Point.loadd(point, pwm)
+        pc.load(d)
         return pc
 
+    def load(self, d):
+        """Add the points in a dict that maps an index to the attributes of a point.
+
+        The routes are replaced by those in the routes key of the dict, if any.
+        Either all points are added or, if one of them is not valid, none.
+        """
+        if not isinstance(d, dict):
+            raise ValueError("collection is not an object")
+        routes = RouteTable.load(d.get("routes", {}))
+        points = []
+        for index, point in d.items():
+            if index == "routes":
+                continue
+            if isinstance(point, dict) and "index" not in point:
+                point = dict(point, index=index)
+            points.append((index, Point.loadd(point, self.pwm)))
+        setattr, setitem = object.__setattr__, super().__setitem__
+        # what __setitem__ does, without a touch() per point
+        for index, point in points:
+            setattr(point, "scheduler", self.scheduler)
+            setattr(point, "_owner", self)
+            setitem(index, point)
+        self.routes = routes
+        self.touch()
+
+    def move_many(self, targets, priority=0):
+        """Move several points at once.
+
+        targets maps point indices to a position (a number or left, right, mid).
+        Returns a dict of index -> Move if a scheduler is present, otherwise blocks until all points are done.
+        """
+        points = [(self[index], self[index].target(t)) for index, t in targets.items()]
+        if self.scheduler is not None:
+            moves = self.scheduler.submit_many(points, priority)
+            return dict(zip(targets, moves))
+        play(
+            [(p, table(p.current, t, p.speed, p.deltat, p.profile)) for p, t in points]
+        )
+
+    def batch(self, commands):
+        """Apply a list of (index, function, value) commands, either all of them or none.
+
+        function is a function of Point that is called with the point, and with value
+        if that is not None. Commands that change the configuration are applied in
+        order, moves are only started once all of those succeeded, so a batch that
+        fails does not move anything. If a command fails every point is restored and
+        a BatchError is raised.
+        Returns a list with the result of every command.
+        """
+        results = [None] * len(commands)
+        saved = {}  # index -> attributes of a point before the batch changed it
+        moves = []
+        for i, (index, function, value) in enumerate(commands):
+            try:
+                point = self.get(index)
+                if point is None:
+                    raise ValueError(f"no point {index}")
+                if function.__name__ not in Journaled:
+                    # check the target now, a move that fails later cannot be undone
+                    if value is not None:
+                        value = point.target(value)
+                    moves.append((i, point, function, value))
+                    continue
+                if index not in saved:
+                    saved[index] = point.asdict()
+                args = () if value is None else (value,)
+                results[i] = function(point, *args)
+            except ValueError as e:
+                self.restore(saved)
+                raise BatchError(i, str(e)) from e
+        for i, point, function, value in moves:
+            args = () if value is None else (value,)
+            try:
+                results[i] = function(point, *args)
+            except ValueError as e:
+                self.restore(saved)
+                raise BatchError(i, str(e)) from e
+        return results
+
+    def restore(self, saved):
+        """Save the attributes of points, saved maps their index to what asdict() returned."""
+        for index, d in saved.items():
+            self[index].save(d)
+
+    def home(self, priority=0):
+        """Move every point to its default position, see move_many().
+
+        The longest moves are started first, so that if the power budget of the
+        scheduler does not allow all of them at once, all are done as soon as possible.
+        """
+
+        def duration(item):
+            point = self[item[0]]
+            return abs(point.target(item[1]) - point.current) / point.speed
+
+        targets = {index: point.default for index, point in self.items()}
+        return self.move_many(
+            dict(sorted(targets.items(), key=duration, reverse=True)), priority
+        )
+
+    def resync(self, values):
+        """Set the current position of the points from the 12-bit pulse lengths of their ports.
+
+        values maps a port to what the controller outputs, for example after a restart.
+        A position that still maps to the same value is left alone, ports without a
+        value or with one outside the range of a servo are ignored.
+        Returns the number of points whose position changed.
+        """
+        changed = 0
+        for point in self.values():
+            v = values.get(point.port)
+            if v is None or v == profiles.value(point.current):
+                continue
+            current = profiles.position(v)
+            if -1.01 <= current <= 1.01:  # rounding may put the ends just outside
+                point.current = min(1.0, max(-1.0, current))
+                changed += 1
+        return changed
+
+    def setroute(self, name, d):
+        """Add or replace a route, raises a ValueError if it is not valid for these points."""
+        route = Route.loadd(name, d)
+        route.check(self)
+        self.routes.add(route)
+        self.touch()
+
+    def deleteroute(self, name):
+        self.routes.remove(name)
+        self.touch()
+
+    def setroutepoints(self, name):
+        """Set a route: lock it against conflicting routes and move all its points at once.
+
+        Raises a ValueError if a point cannot be set or a conflicting route is set.
+        Returns what move_many() returns.
+        """
+        route = self.routes.get(name)
+        route.check(self)
+        self.routes.lock(name)
+        return self.move_many(route.positions)
+
+    def apply(self, record):
+        """Apply a change recorded in the journal, see Server.record()."""
+        op, index = record["op"], record.get("index")
+        if op == "batch":
+            for r in record["records"]:
+                self.apply(r)
+        elif op == "add":
+            self[index] = Point.loadd(record["point"], self.pwm)
+        elif op == "delete":
+            self.pop(index, None)
+        elif op == "restore":
+            self.clear()
+            self.load(record["points"])
+        elif op == "route":
+            self.routes.add(Route.loadd(index, record["route"]))
+            self.touch()
+        elif op == "deleteroute":
+            if index in self.routes:
+                self.deleteroute(index)
+        elif index in self and op in Journaled:
+            method = getattr(self[index], op)
+            if "value" in record:
+                method(record["value"])
+            else:
+                method()
+
     def getfreeports(self):
-        used = set(p.port for p in self.values())
-        possible = set(range(16))
-        return possible - used
+        return set(self.freeportlist())
+
+    def freeportlist(self):
+        def compute():
+            used = set(p.port for p in self.values())
+            possible = range(getattr(self.pwm, "channels", 16))
+            return [p for p in possible if p not in used]
+
+        return self.cached("freeports", compute)
 
     def getfreeport(self):
         return self.getfreeports().pop()
@@ -227,19 +763,5 @@ class PointCollection(OrderedDict):
 class PointEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Point):
-            return {
-                "index": obj.index,
-                "port": obj.port,
-                "name": obj.name,
-                "enabled": obj.enabled,
-                "current": obj.current,
-                "description": obj.description,
-                "_left": obj._left,
-                "_right": obj._right,
-                "_mid": obj._mid,
-                "speed": obj.speed,
-                "default": obj.default,
-                "deltat": obj.deltat,
-                "pointtype": obj.pointtype,
-            }
+            return obj.asdict()
         return json.JSONEncoder.default(self, obj)
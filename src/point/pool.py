@@ -0,0 +1,69 @@
+CHANNELS = 16  # number of channels on a single PCA9685
+MAXBOARDS = 62  # number of usable i2c addresses for a PCA9685 (0x40-0x7F minus ALLCALL and SWRST)
+
+
+class ControllerPool:
+    """A collection of servo controllers that presents itself as a single controller.
+
+    Global port numbers are mapped onto the boards in the order they were given,
+    i.e. ports 0-15 are on the first board, ports 16-31 on the second, etc.
+    """
+
+    def __init__(self, controllers):
+        if len(controllers) < 1 or len(controllers) > MAXBOARDS:
+            raise ValueError(f"number of controllers not in range [1,{MAXBOARDS}]")
+        self.controllers = list(controllers)
+        self.channels = CHANNELS * len(self.controllers)
+
+    def locate(self, port):
+        """Return the (controller, channel) tuple for a global port number."""
+        if port < 0 or port >= self.channels:
+            raise ValueError(f"port not in range [0,{self.channels - 1}]")
+        return self.controllers[port // CHANNELS], port % CHANNELS
+
+    def address(self, port):
+        """Return the (i2c address, channel) tuple for a global port number."""
+        controller, channel = self.locate(port)
+        return getattr(controller, "address", None), channel
+
+    def setPWMFreq(self, freq):
+        for controller in self.controllers:
+            controller.setPWMFreq(freq)
+
+    def readServoValues(self):
+        """Return a dict port -> 12-bit pulse length read back from the boards."""
+        values = {}
+        for i, controller in enumerate(self.controllers):
+            for channel, value in controller.readServoValues().items():
+                values[CHANNELS * i + channel] = value
+        return values
+
+    def setServoPulse(self, port, pulse):
+        controller, channel = self.locate(port)
+        controller.setServoPulse(channel, pulse)
+
+    def setServoPulses(self, pulses):
+        """Set several ports at once, the writes are batched per board."""
+        for controller, channels in self.boards(pulses):
+            if hasattr(controller, "setServoPulses"):
+                controller.setServoPulses(channels)
+            else:
+                for channel, pulse in channels.items():
+                    controller.setServoPulse(channel, pulse)
+
+    def setServoValues(self, values):
+        """Set several ports at once to a 12-bit register value, batched per board."""
+        for controller, channels in self.boards(values):
+            controller.setServoValues(channels)
+
+    def boards(self, ports):
+        """Split a dict of port -> value into a list of (controller, {channel: value}) tuples."""
+        boards = {}
+        for port, value in ports.items():
+            controller, channel = self.locate(port)
+            boards.setdefault(id(controller), (controller, {}))[1][channel] = value
+        return list(boards.values())
+
+    def setAllServoPulse(self, pulse):
+        for controller in self.controllers:
+            controller.setAllServoPulse(pulse)
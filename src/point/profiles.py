@@ -0,0 +1,130 @@
+from array import array
+from functools import lru_cache
+from math import ceil
+
+numpy = None  # numpy is optional, it only makes computing long tables faster
+imported = False  # True once importnumpy() tried to import it
+
+RAMP = 0.25  # fraction of the time a trapezoid profile spends accelerating (and decelerating)
+
+
+# the three phases of a trapezoid profile, these work on numbers and on numpy arrays
+def accelerate(u):
+    return u * u / (2 * RAMP * (1 - RAMP))
+
+
+def cruise(u):
+    return (u - RAMP / 2) / (1 - RAMP)
+
+
+def decelerate(u):
+    return 1 - (1 - u) * (1 - u) / (2 * RAMP * (1 - RAMP))
+
+
+def trapezoid(u):
+    return accelerate(u) if u < RAMP else cruise(u) if u <= 1 - RAMP else decelerate(u)
+
+
+def scurve(u):
+    """Smootherstep: both velocity and acceleration are zero at the start and the end."""
+    return u * u * u * (u * (6 * u - 15) + 10)
+
+
+# for every profile the shape s(u) that maps the fraction of time u in [0, 1] to the
+# fraction of the distance travelled, and the ratio of its top speed to its average speed
+Shapes = {
+    "linear": (lambda u: u, 1.0),
+    "trapezoid": (trapezoid, 1 / (1 - RAMP)),
+    "scurve": (scurve, 15 / 8),
+}
+Profiles = set(Shapes)
+
+
+def importnumpy():
+    """Return the numpy module, or None if it is not available.
+
+    numpy takes a while to import, so it is only imported when it is first needed
+    (or when this is called from a background thread at startup).
+    """
+    global numpy, imported
+    if not imported:
+        try:
+            import numpy
+        except ImportError:
+            pass
+        imported = True
+    return numpy
+
+
+def position(value):
+    """Return the position in the middle of the range that maps to a 12-bit register value."""
+    return ((value + 0.5) * 20000 / 4096 - 500) / 1000 - 1
+
+
+def value(position):
+    """Return the 12-bit register value for a position in [-1, 1], the PWM frequency must be 50Hz."""
+    # map [-1, 1] -> [500, 2500] μs and a 20000 μs period to 4096 steps
+    return int((((position + 1.0) / 2.0) * 2000 + 500) * 4096 / 20000)
+
+
+class Table:
+    """The precomputed positions and 12-bit register values of a single move.
+
+    positions[i] and values[i] are the position and register value deltat * i
+    seconds after the start of the move, the last entry is the end position.
+    Tables are shared between moves, so they should not be changed.
+    """
+
+    __slots__ = ("positions", "values", "deltat")
+
+    def __init__(self, positions, values, deltat):
+        self.positions = positions
+        self.values = values
+        self.deltat = deltat
+
+    def __len__(self):
+        return len(self.positions)
+
+    def step(self, elapsed):
+        """Return the index of the entry for elapsed seconds after the start."""
+        return min(int(elapsed / self.deltat), len(self.positions) - 1)
+
+    def position(self, i):
+        return float(self.positions[i])
+
+    def value(self, i):
+        return int(self.values[i])
+
+
+@lru_cache(maxsize=256)
+def table(start, end, speed, deltat, profile="linear"):
+    """Return the Table for a move from start to end.
+
+    speed is the top speed in units per second, so for the same speed a trapezoid
+    or S-curve move takes a bit longer than a linear one.
+    """
+    shape, peak = Shapes[profile]
+    distance = end - start
+    n = max(1, ceil(abs(distance) * peak / (speed * deltat)))  # number of steps
+    numpy = importnumpy()
+    if numpy is not None:
+        u = numpy.arange(n + 1) / n
+        if profile == "trapezoid":
+            s = numpy.piecewise(
+                u,
+                [u < RAMP, (u >= RAMP) & (u <= 1 - RAMP), u > 1 - RAMP],
+                [accelerate, cruise, decelerate],
+            )
+        else:
+            s = shape(u)
+        positions = start + distance * s
+        positions[-1] = end
+        values = ((((positions + 1.0) / 2.0) * 2000 + 500) * 4096 / 20000).astype(
+            numpy.uint16
+        )
+        positions.flags.writeable = values.flags.writeable = False
+    else:
+        positions = array("d", (start + distance * shape(i / n) for i in range(n)))
+        positions.append(end)
+        values = array("H", map(value, positions))
+    return Table(positions, values, deltat)
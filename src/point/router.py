@@ -0,0 +1,64 @@
+from urllib.parse import unquote
+
+
+class Router:
+    """Maps a method and a path to a handler, with the parameters found in the path.
+
+    Patterns are paths in which a segment may be a parameter: {name} or
+    {name:type}, where type is one of the converters (str if omitted).
+    A path that does not match any pattern, or with a parameter that cannot be
+    converted to its type, is not found.
+
+    Patterns are compiled when they are added and indexed on the method, the
+    number of segments and the first segment, so finding the handler for a path
+    only has to look at the few routes that share those.
+    """
+
+    converters = {"str": str, "int": int, "float": float}
+
+    def __init__(self):
+        self.routes = {}  # (method, number of segments, first segment) -> routes
+
+    def add(self, method, pattern, handler, **fixed):
+        """Route method requests for pattern to handler.
+
+        handler is called with the parameters in the path and the fixed keyword arguments.
+        """
+        literals, params = [], []
+        segments = pattern.strip("/").split("/")
+        for i, segment in enumerate(segments):
+            if segment.startswith("{") and segment.endswith("}"):
+                name, _, kind = segment[1:-1].partition(":")
+                params.append((i, name, self.converters[kind or "str"]))
+            else:
+                literals.append((i, segment))
+        if not literals or literals[0][0] != 0:
+            raise ValueError(f"pattern should start with a fixed segment {pattern}")
+        key = (method, len(segments), segments[0])
+        self.routes.setdefault(key, []).append(
+            (tuple(literals[1:]), tuple(params), handler, fixed, pattern)
+        )
+
+    def route(self, method, pattern, **fixed):
+        """Return a decorator that adds a route to the function it decorates."""
+
+        def decorate(handler):
+            self.add(method, pattern, handler, **fixed)
+            return handler
+
+        return decorate
+
+    def match(self, method, path):
+        """Return a (handler, keyword arguments, pattern) tuple for a request, or None."""
+        segments = path.split("?", 1)[0].strip("/").split("/")
+        routes = self.routes.get((method, len(segments), segments[0]), ())
+        for literals, params, handler, fixed, pattern in routes:
+            if all(segments[i] == literal for i, literal in literals):
+                kwargs = dict(fixed)
+                try:
+                    for i, name, convert in params:
+                        kwargs[name] = convert(unquote(segments[i]))
+                except ValueError:
+                    continue
+                return handler, kwargs, pattern
+        return None
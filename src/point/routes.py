@@ -0,0 +1,145 @@
+def positions(pointtype):
+    """Return the positions a point of this type can be set to."""
+    return ("left", "mid", "right") if pointtype == "triple" else ("left", "right")
+
+
+class Route:
+    """A set of points, each with the position it should be in for a train to pass."""
+
+    __slots__ = ("name", "positions", "description")
+
+    def __init__(self, name, positions, description=""):
+        self.name = name
+        self.positions = positions  # point index -> left, right or mid
+        self.description = description
+
+    @staticmethod
+    def loadd(name, d):
+        """Return a Route from a dict, raises a ValueError if it is not valid."""
+        if not isinstance(name, str) or not name:
+            raise ValueError("route name is not a non empty string")
+        if not isinstance(d, dict) or not isinstance(d.get("positions"), dict):
+            raise ValueError(f"route {name} has no positions")
+        for index, position in d["positions"].items():
+            if position not in ("left", "mid", "right"):
+                raise ValueError(f"route {name} has an unknown position for {index}")
+        description = d.get("description", "")
+        if not isinstance(description, str):
+            raise ValueError(f"description of route {name} is not a string")
+        return Route(name, dict(d["positions"]), description[:1024])
+
+    def asdict(self):
+        return {"positions": dict(self.positions), "description": self.description}
+
+    def check(self, points):
+        """Raise a ValueError if a point of the route is not in points or cannot be set to its position."""
+        for index, position in self.positions.items():
+            point = points.get(index)
+            if point is None:
+                raise ValueError(f"route {self.name} uses an unknown point {index}")
+            if position not in positions(point.pointtype):
+                raise ValueError(
+                    f"point {index} of route {self.name} is a {point.pointtype} point without a {position} position"
+                )
+
+
+class RouteTable:
+    """The routes of a layout and an index of the routes that conflict.
+
+    Two routes conflict when they need a point in a different position. The
+    conflicts of a route are determined once, when it is added, and every route
+    keeps count of the routes that are set and conflict with it, so whether a
+    route can be set is a single lookup.
+    """
+
+    def __init__(self):
+        self.routes = {}  # name -> Route
+        self.conflicts = {}  # name -> set of names of conflicting routes
+        self.users = {}  # point index -> set of names of the routes that use it
+        self.active = set()  # names of the routes that are set
+        self.blocked = {}  # name -> number of routes that are set and conflict with it
+
+    def __contains__(self, name):
+        return name in self.routes
+
+    def __len__(self):
+        return len(self.routes)
+
+    def get(self, name):
+        return self.routes.get(name)
+
+    @staticmethod
+    def load(d):
+        """Return a RouteTable with the routes in a dict that maps a name to the attributes of a route."""
+        if not isinstance(d, dict):
+            raise ValueError("routes is not an object")
+        table = RouteTable()
+        for name, route in d.items():
+            table.add(Route.loadd(name, route))
+        return table
+
+    def asdict(self):
+        return {name: route.asdict() for name, route in self.routes.items()}
+
+    def add(self, route):
+        """Add a route, or replace the route with the same name (which is released first)."""
+        if route.name in self.routes:
+            self.remove(route.name)
+        conflicts = set()
+        for index, position in route.positions.items():
+            for name in self.users.get(index, ()):
+                if self.routes[name].positions[index] != position:
+                    conflicts.add(name)
+        for name in conflicts:
+            self.conflicts[name].add(route.name)
+        for index in route.positions:
+            self.users.setdefault(index, set()).add(route.name)
+        self.routes[route.name] = route
+        self.conflicts[route.name] = conflicts
+        self.blocked[route.name] = len(conflicts & self.active)
+
+    def remove(self, name):
+        self.release(name)
+        route = self.routes.pop(name)
+        for other in self.conflicts.pop(name):
+            self.conflicts[other].discard(name)
+        for index in route.positions:
+            self.users[index].discard(name)
+            if not self.users[index]:
+                del self.users[index]
+        del self.blocked[name]
+
+    def available(self, name):
+        """Return True if no route that conflicts with this one is set."""
+        return self.blocked[name] == 0
+
+    def lock(self, name):
+        """Mark a route as set, raises a ValueError if a conflicting route is set."""
+        if name in self.active:
+            return
+        if self.blocked[name]:
+            raise ValueError(
+                f"route {name} conflicts with {', '.join(self.blocking(name))}"
+            )
+        self.active.add(name)
+        for other in self.conflicts[name]:
+            self.blocked[other] += 1
+
+    def release(self, name):
+        """Mark a route as no longer set, so conflicting routes can be set."""
+        if name in self.active:
+            self.active.discard(name)
+            for other in self.conflicts[name]:
+                self.blocked[other] -= 1
+
+    def blocking(self, name):
+        """Return the names of the routes that are set and conflict with this one."""
+        return sorted(self.conflicts[name] & self.active)
+
+    def status(self, name):
+        return dict(
+            self.routes[name].asdict(),
+            conflicts=sorted(self.conflicts[name]),
+            set=name in self.active,
+            available=self.available(name),
+        )
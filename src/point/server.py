@@ -1,292 +1,954 @@
 import json
-from base64 import b64decode
+import selectors
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from io import BytesIO
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from json.decoder import JSONDecodeError
-from os import scandir
-from os.path import exists, join
-from re import compile
-from urllib.parse import unquote
-from uuid import uuid4
+from os.path import exists
+from queue import SimpleQueue
+from threading import RLock, Thread
+from urllib.parse import parse_qs, urlsplit
 import time
-import email
 
-from .point import Point, PointCollection, PointEncoder
+from .auth import Authenticator, load
+from .backups import BackupStore
+from .events import EventHub
+from .log import LogWriter
+from .metrics import Collected, Counter, Histogram, Registry
+from .motion import Move, MotionScheduler
+from .point import BatchError, Journaled, Point, PointCollection, Transient
+from .router import Router
+from .store import Journal
 
-GUID = compile(r"^[a-f01-9]{32}$")
+router = Router()
+
+# the actions on a point by their name in a PUT /point/ID/ACTION request
+Actions = {
+    "moveleft": Point.moveleft,
+    "left": Point.moveleft,
+    "moveright": Point.moveright,
+    "right": Point.moveright,
+    "enable": Point.enable,
+    "disable": Point.disable,
+    "start": Point.movestart,
+}
+
+# the attributes of a point that can be set with PUT /point/ID/ATTRIBUTE/VALUE
+# and the type of their value, each can also be named with a set prefix
+Attributes = {
+    "left": (Point.setleft, "float"),
+    "right": (Point.setright, "float"),
+    "mid": (Point.setmid, "float"),
+    "deltat": (Point.setdeltat, "float"),
+    "speed": (Point.setspeed, "float"),
+    "port": (Point.setport, "float"),
+    "pointtype": (Point.setpointtype, "str"),
+    "default": (Point.setdefault, "str"),
+    "description": (Point.setdescription, "str"),
+    "profile": (Point.setprofile, "str"),
+    "cost": (Point.setcost, "float"),
+}
+
+
+def command(item):
+    """Return an (index, function, value) tuple for a command in a batch.
+
+    item is a dict with the id of a point, the name of a command as in a PUT
+    /point/ID/... request and, for attributes, move and save, a value.
+    Raises a ValueError if it is not a valid command.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("a command should be an object with an id and a command")
+    index, name, value = item.get("id"), item.get("command"), item.get("value")
+    if not isinstance(index, str) or not isinstance(name, str):
+        raise ValueError("a command should have a string id and command")
+    if value is None and name in Actions:
+        return index, Actions[name], None
+    if name == "save" and isinstance(value, dict):
+        return index, Point.save, value
+    if name == "move" and isinstance(value, (int, float)):
+        return index, Point.goto, float(value)
+    setter, kind = Attributes.get(name[3:] if name.startswith("set") else name, (0, 0))
+    if kind == "float" and isinstance(value, (int, float)):
+        return index, setter, float(value)
+    if kind == "str" and isinstance(value, str):
+        return index, setter, value
+    raise ValueError(f"unknown command {name} or wrong type of value")
 
 
 class Server(HTTPServer):
-    def __init__(self, address, handler, dbfile, pwm, secret, backupdir, logfile):
+    def __init__(
+        self,
+        address,
+        handler,
+        dbfile,
+        pwm,
+        secret,
+        backupdir,
+        logfile,
+        tick=0.02,
+        workers=0,
+        keepalive=None,
+        bind_and_activate=True,
+        savedelay=1.0,
+        journalsize=65536,
+        logsize=1048576,
+        logbackups=3,
+        logjson=False,
+        tokenlifetime=3600,
+        backupkeep=0,
+        backupdays=0,
+        budget=0,
+        boardbudget=0,
+    ):
         self.pc = None
         self.dbfile = dbfile
+        # guards self.pc, held by request handlers and the motion scheduler
+        self.lock = RLock()
+        # with workers > 0 requests are handled by a pool of that many threads
+        self.executor = ThreadPoolExecutor(workers) if workers > 0 else None
+        self.keepalive = keepalive  # seconds before an idle connection is closed
+        # idle keep-alive connections wait for their next request in a selector
+        # instead of in a thread of the pool, see watch()
+        self.parked = SimpleQueue()  # handlers to watch, None to stop
+        self.wakeup = socket.socketpair()
+        self.watcher = None
+        if self.executor is not None:
+            self.watcher = Thread(target=self.watch, name="keepalive", daemon=True)
+            self.watcher.start()
+        self.events = EventHub()  # changes to points are published here
+        # moves are executed in the background, positions are not persisted by themselves
+        # with a budget (in amperes) moves wait until the power supply can take it
+        self.scheduler = MotionScheduler(
+            tick=tick, events=self.events, budget=budget, boardbudget=boardbudget
+        )
 
         if exists(dbfile):
             with open(dbfile) as f:
-                config = "\n".join(f.readlines())
+                config = f.read()
                 try:
                     self.pc = PointCollection.loads(config, pwm=pwm)
-                except JSONDecodeError as e:
+                except ValueError as e:
                     raise ValueError(f"could not correctly read config file {e}")
 
         else:  # we started with an empty database
             self.pc = PointCollection(pwm=pwm)
+        # changes since the last snapshot are appended to a journal, at most once every savedelay seconds
+        self.journal = Journal(dbfile, self.snapshot, savedelay, journalsize)
+        if self.journal.replay(self.pc.apply) and self.journal.size > journalsize:
+            self.journal.compact()
+        if len(self.pc) == 0:
             point0 = Point(0, "Point at port 0", pwm=pwm)
             self.pc[point0.getindex()] = point0
             self.writeDBfile()
+        self.pc.setscheduler(self.scheduler)
 
         if secret is not None and exists(secret):
-            with open(secret) as f:
-                self.secret = f.readline().strip()
+            self.auth = Authenticator(load(secret), tokenlifetime)
         else:
             raise ValueError(f"could not correctly read file with secret {secret}")
 
         if not exists(backupdir):
             raise FileNotFoundError(f"backup directory does not exist {backupdir}")
         self.backupdir = backupdir
-        self.logfile = open(logfile, "a", buffering=1)
-        super().__init__(address, handler)
+        self.backups = BackupStore(backupdir, backupkeep, backupdays)
+        # log lines are written in the background, rotated once the file exceeds logsize bytes
+        self.log = LogWriter(logfile, logsize, logbackups, logjson)
+        # the controller knows where the servos are better than the json file does
+        if hasattr(pwm, "readServoValues"):
+            try:
+                changed = self.pc.resync(pwm.readServoValues())
+                self.log_message(f"positions of {changed} points read back")
+            except OSError as e:
+                self.log_message(f"could not read back positions {e}")
+        self.metrics = self.setupmetrics()
+        super().__init__(address, handler, bind_and_activate)
         self.log_message("Server started")
 
+    def process_request(self, request, client_address):
+        if self.executor is None:
+            return super().process_request(request, client_address)
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address, handler=None):
+        """Handle the requests on a connection until it is closed or idle.
+
+        A new connection gets a handler, a connection that was idle (handler)
+        has a new request. An idle connection is parked, it keeps its handler.
+        """
+        try:
+            if handler is None:
+                handler = self.RequestHandlerClass(request, client_address, self)
+            else:
+                handler.resume()
+        except Exception:
+            self.handle_error(request, client_address)
+            handler = None
+        if handler is not None and handler.parked:
+            self.parked.put(handler)
+            self.wakeup[1].send(b"\0")
+        else:
+            self.shutdown_request(request)
+
+    def watch(self):
+        """Hand parked connections back to the pool when a request arrives, close those idle too long.
+
+        So a connection only takes a thread of the pool while a request is handled,
+        and many more clients than workers can keep their connection open.
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self.wakeup[0], selectors.EVENT_READ)
+        idle = {}  # handler -> monotonic time it was parked, oldest first
+        while True:
+            timeout = None
+            if idle and self.keepalive is not None:
+                timeout = max(
+                    0, next(iter(idle.values())) + self.keepalive - time.monotonic()
+                )
+            for key, _ in selector.select(timeout):
+                if key.fileobj is self.wakeup[0]:
+                    self.wakeup[0].recv(4096)
+                    continue
+                selector.unregister(key.fileobj)
+                del idle[key.data]
+                self.executor.submit(
+                    self.process_request_thread,
+                    key.fileobj,
+                    key.data.client_address,
+                    key.data,
+                )
+            while not self.parked.empty():
+                handler = self.parked.get()
+                if handler is None:  # the server is closed
+                    for handler in idle:
+                        self.close_idle(handler)
+                    selector.close()
+                    return
+                selector.register(handler.request, selectors.EVENT_READ, handler)
+                idle[handler] = time.monotonic()
+            if self.keepalive is not None:
+                now = time.monotonic()
+                for handler, parked in list(idle.items()):
+                    if now - parked < self.keepalive:
+                        break
+                    selector.unregister(handler.request)
+                    del idle[handler]
+                    self.close_idle(handler)
+
+    def close_idle(self, handler):
+        handler.parked = False
+        try:
+            handler.finish()
+        except OSError:
+            pass
+        self.shutdown_request(handler.request)
+
+    def server_close(self):
+        super().server_close()
+        if self.executor is not None:
+            # stop the watcher first, it hands connections to the executor
+            self.parked.put(None)
+            self.wakeup[1].send(b"\0")
+            self.watcher.join()
+            self.executor.shutdown(wait=False)
+        self.journal.close()
+        self.log.close()
+
+    def setupmetrics(self):
+        """Create the metrics that are served on /server/metrics."""
+        metrics = Registry()
+        self.requests = metrics.add(
+            Histogram(
+                "point_http_request_duration_seconds",
+                "Time to handle a request, from its request line to the response.",
+                ("method", "route"),
+            )
+        )
+        self.authfailures = metrics.add(
+            Counter("point_auth_failures_total", "Requests with a wrong password.")
+        )
+        pwm = self.pc.pwm
+        controllers = getattr(pwm, "controllers", [pwm])
+
+        def i2c(attribute):
+            values = {
+                (hex(getattr(c, "address", 0)),): getattr(c, attribute)
+                for c in controllers
+                if hasattr(c, attribute)
+            }
+            return values or None  # a MockPWM has no bus
+
+        scheduler, timing, journal = self.scheduler, self.scheduler.timing, self.journal
+        for name, help, function, type in (
+            ("point_points", "Number of points.", lambda: len(self.pc), "gauge"),
+            (
+                "point_moves_inflight",
+                "Moves that are queued or running.",
+                scheduler.inflight,
+                "gauge",
+            ),
+            (
+                "point_moves_waiting",
+                "Moves that wait for the power budget.",
+                scheduler.waitingcount,
+                "gauge",
+            ),
+            (
+                "point_motion_current_amperes",
+                "Estimated current drawn by the moving servos.",
+                lambda: scheduler.used,
+                "gauge",
+            ),
+            (
+                "point_motion_ticks_total",
+                "Ticks of the motion scheduler.",
+                lambda: timing.ticks,
+                "counter",
+            ),
+            (
+                "point_motion_overruns_total",
+                "Ticks that took longer than the tick period.",
+                lambda: timing.overruns,
+                "counter",
+            ),
+            (
+                "point_motion_skipped_ticks_total",
+                "Ticks skipped to catch up after an overrun.",
+                lambda: timing.skipped,
+                "counter",
+            ),
+            (
+                "point_motion_tick_busy_seconds_max",
+                "Longest time spent in a single tick.",
+                lambda: timing.busymax / 1e9,
+                "gauge",
+            ),
+            (
+                "point_motion_tick_jitter_seconds_max",
+                "Latest start of a tick.",
+                lambda: timing.jittermax / 1e9,
+                "gauge",
+            ),
+            (
+                "point_journal_appends_total",
+                "Batches of changes appended to the journal.",
+                lambda: journal.appends,
+                "counter",
+            ),
+            (
+                "point_journal_append_seconds_total",
+                "Time spent appending to the journal.",
+                lambda: journal.appendtime,
+                "counter",
+            ),
+            (
+                "point_dbfile_writes_total",
+                "Rewrites of the json file (writeDBfile and compactions).",
+                lambda: journal.compactions,
+                "counter",
+            ),
+            (
+                "point_dbfile_write_seconds_total",
+                "Time spent rewriting the json file.",
+                lambda: journal.compactiontime,
+                "counter",
+            ),
+            (
+                "point_uptime_seconds",
+                "Seconds since the server started.",
+                lambda: time.time() - self.pc.start_time,
+                "gauge",
+            ),
+        ):
+            metrics.add(Collected(name, help, function, type))
+        for attribute, name, help in (
+            ("transactions", "point_i2c_transactions", "I2C transactions."),
+            ("transferred", "point_i2c_bytes", "Register bytes read or written."),
+            ("saved", "point_i2c_writes_saved", "Writes skipped, value unchanged."),
+        ):
+            function = lambda attribute=attribute: i2c(attribute)
+            metrics.add(
+                Collected(name + "_total", help, function, "counter", ("address",))
+            )
+        return metrics
+
+    def snapshot(self):
+        with self.lock:
+            return self.pc.dumps(), self.journal.seq
+
     def writeDBfile(self):
-        with open(self.dbfile, "w") as f:
-            f.write(self.pc.dumps())
+        """Write the dbfile immediately and empty the journal."""
+        self.journal.compact()
 
-    def known_backup(self, backupid):
-        if GUID.fullmatch(backupid):
-            return exists(join(self.backupdir, backupid))
-        return False
+    def record(self, op, index=None, **kwargs):
+        """Record a change of the point collection in the journal.
 
-    def list_backups(self):
-        backups = {}
-        with scandir(self.backupdir) as it:
-            for entry in it:
-                if GUID.fullmatch(entry.name) and entry.is_file():
-                    backups[entry.name] = datetime.fromtimestamp(
-                        entry.stat().st_mtime
-                    ).isoformat()
+        op is either add, delete, restore or a command that is replayed by calling the
+        method of the point with that name, with value as its argument if present.
+        """
+        kwargs.update(op=op, index=index)
+        self.journal.record(kwargs)
+
+    def list_backups(self, offset=0, limit=None):
+        backups = {
+            entry["id"]: datetime.fromtimestamp(entry["time"]).isoformat()
+            for entry in self.backups.list(offset, limit)
+        }
         return json.dumps(backups)
 
     def backup(self):
-        with open(join(self.backupdir, uuid4().hex), "w") as f:
-            f.write(self.pc.dumps())
-            self.log_message("backup created")
-            return True
+        """Back up the points, returns the id of the backup."""
+        backupid, new = self.backups.add(self.pc.dumps(), len(self.pc))
+        self.log_message("backup created" if new else "backup unchanged")
+        return backupid
 
     def restore(self, backupid):
-        with open(join(self.backupdir, backupid)) as f:
-            config = "\n".join(f.readlines())
-        self.pc = PointCollection.loads(config, pwm=self.pc.pwm)
+        """Restore a backup, after backing up the current points."""
+        points = json.loads(self.backups.load(backupid))
+        # only now, the new backup may prune the one that is restored
+        self.backup()
+        pc = PointCollection(pwm=self.pc.pwm)
+        pc.load(points)
+        # the servos did not move, a point keeps the position of the point it replaces
+        self.scheduler.cancel(self.pc.values())
+        positions = {point.port: point.current for point in self.pc.values()}
+        for point in pc.values():
+            point.current = positions.get(point.port, point.current)
+        self.pc = pc
+        self.pc.setscheduler(self.scheduler)
+        self.record("restore", points=points)
+        self.journal.compact(wait=False)  # no need to keep such a large record around
+        self.events.publish({"reload": True})
         self.log_message("backup restored")
         return True
 
+    def authorized(self, header):
+        """Return the user if header is the value of a valid Authorization header, None otherwise."""
+        user = self.auth.check(header)
+        if user is None:
+            self.authfailures.inc()
+        return user
+
     def log_message(self, format, *args):
-        self.logfile.write(
-            "%s - - [%s] %s\n"
-            % ("-", email.utils.formatdate(time.time(), usegmt=True), format % args)
-        )
+        self.log.write(format % args)
+
+
+def synchronized(method):
+    """Run a request handler method while holding the server lock.
+
+    The response is collected in memory and only sent after the lock is released,
+    so a slow client cannot hold up other requests. A method can leave the rest of
+    the body in self.stream, which is then sent without holding the lock.
+    """
+
+    def wrapper(self, *args, **kwargs):
+        wfile, self.wfile = self.wfile, BytesIO()
+        try:
+            with self.server.lock:
+                method(self, *args, **kwargs)
+        finally:
+            wfile.write(self.wfile.getvalue())
+            self.wfile = wfile
+        if self.stream is not None:
+            self.send_stream()
+
+    return wrapper
 
 
 class RESTHandler(BaseHTTPRequestHandler):
-    def auth(self):
-        # for header in self.headers:
-        #    print(header, self.headers[header])
+    protocol_version = "HTTP/1.1"  # keep connections alive between requests
+    router = router  # maps requests to the methods below
+    maxbody = 1 << 20  # bytes, larger request bodies are refused
+
+    def setup(self):
+        # a single thread cannot afford to wait for idle connections
+        if self.server.executor is None:
+            self.protocol_version = "HTTP/1.0"
+        # give up on a request that takes longer than this to arrive
+        self.timeout = self.server.keepalive
+        self.parked = False  # waiting for the next request without a thread
+        super().setup()
+
+    def handle(self):
+        self.parked = False
+        self.handle_one_request()
+        while not self.close_connection:
+            if self.server.executor is not None and not self.buffered():
+                self.parked = True
+                return
+            self.handle_one_request()
+
+    def resume(self):
+        """Handle the requests on a parked connection that has a new request."""
         try:
-            auth = self.headers["Authorization"]
-            if auth is None:
-                raise KeyError
-            basic, msg = auth.split()
-            if basic != "Basic":
-                raise KeyError
-            if b64decode(msg).decode() == self.server.secret:
-                return True
-        except KeyError:
-            pass
-        self.send_response(401)
+            self.handle()
+        finally:
+            self.finish()
+
+    def finish(self):
+        if self.parked:  # keep the connection open
+            self.wfile.flush()
+        else:
+            super().finish()
+
+    def buffered(self):
+        """Return True if (part of) the next request was already received."""
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError as e:
+            ssl = sys.modules.get("ssl")  # only imported if the server uses TLS
+            return not (ssl is not None and isinstance(e, ssl.SSLWantReadError))
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def parse_request(self):
+        self.started = time.perf_counter()  # the request line has just been read
+        self.status = None
+        self.route = "unmatched"  # the pattern of the route, a label of the metrics
+        self.stream = None  # an iterable with chunks of the body still to send
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def handle_one_request(self):
+        self.status = None
+        super().handle_one_request()
+        if self.status is not None:
+            self.server.requests.observe(
+                time.perf_counter() - self.started,
+                self.command,
+                self.route,
+            )
+
+    def respond(self, code, body=b"", content_type="application/json", etag=None):
+        self.send_response(code)
+        if body:
+            self.send_header("Content-type", content_type)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_stream(self, content_type="application/x-ndjson"):
+        """Send the headers of a response whose body is sent in chunks from self.stream."""
+        self.chunked = self.request_version == self.protocol_version == "HTTP/1.1"
+        self.send_response(200)
+        self.send_header("Content-type", content_type)
+        if self.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:  # the end of the body is where the connection is closed
+            self.close_connection = True
         self.end_headers()
+
+    def send_stream(self):
+        for chunk in self.stream:
+            if self.chunked:
+                chunk = f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n"
+            self.wfile.write(chunk)
+            self.wfile.flush()
+        if self.chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def respond_cached(self, etag, body, content_type="application/json"):
+        """Respond with body, or with 304 Not Modified if the client already has this version."""
+        match = self.headers.get("If-None-Match")
+        if match is not None and etag in (m.strip() for m in match.split(",")):
+            self.respond(304, etag=etag)
+        else:
+            self.respond(200, body(), content_type, etag)
+
+    def auth(self):
+        self.user = self.server.authorized(self.headers["Authorization"])
+        if self.user is not None:
+            return True
+        self.respond(401)
+        return False
+
+    def readbody(self):
+        """Read the body of the request into self.body, or respond with an error and return False."""
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.respond(400)
+        elif length > self.maxbody:
+            self.respond(413)
+        else:
+            self.body = self.rfile.read(length) if length > 0 else b""
+            return True
         return False
 
-    def do_GET(self):
-        if not self.auth():
+    def dispatch(self):
+        """Authenticate the request, read its body and hand it to the handler of its route."""
+        match = self.router.match(self.command, self.path)
+        self.route = "unmatched" if match is None else match[2]
+        if not self.auth() or not self.readbody():
+            # the body (if any) was not read, so the connection cannot be reused
+            if self.headers.get("Content-Length", "0").strip() != "0":
+                self.close_connection = True
             return
-        elements = unquote(self.path).split("/")
-        if elements[1] == "points":
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(self.server.pc.dumps().encode())
-        elif elements[1] == "point" and elements[2] in self.server.pc:
-            self.send_response(200)
-            self.send_header("Content-type", "text/json")
-            self.end_headers()
-            d = {
-                "point": self.server.pc[elements[2]],
-                "freeports": list(self.server.pc.getfreeports()),
-            }
-            self.wfile.write(json.dumps(d, cls=PointEncoder).encode())
-        elif elements[1] == "server" and elements[2] == "info":
-            self.send_response(200)
-            self.send_header("Content-type", "text/json")
-            self.end_headers()
-            self.wfile.write(getattr(self.server.pc, elements[2])().encode())
-        elif elements[1] == "server" and elements[2] == "backups":
-            self.send_response(200)
-            self.send_header("Content-type", "text/json")
-            self.end_headers()
-            self.wfile.write(self.server.list_backups().encode())
+        self.call(match)
+
+    @synchronized
+    def call(self, match):
+        if match is None:
+            self.respond(404)
+            return
+        handler, kwargs, _ = match
+        handler(self, **kwargs)
+
+    do_GET = do_PUT = do_DELETE = do_POST = dispatch
+
+    def getpoint(self, id):
+        """Return the point with this id, or respond with 404 and return None."""
+        point = self.server.pc.get(id)
+        if point is None:
+            self.respond(404)
+        return point
+
+    @router.route("GET", "/points")
+    def points(self):
+        pc = self.server.pc
+        self.respond_cached(pc.etag(), pc.encoded)
+
+    @router.route("GET", "/point/{id}")
+    def point(self, id):
+        pc = self.server.pc
+        if self.getpoint(id) is not None:
+            self.respond_cached(pc.etag(), lambda: pc.encodedpoint(id), "text/json")
+
+    @router.route("GET", "/server/info")
+    def info(self):
+        self.respond(200, self.server.pc.info().encode(), "text/json")
+
+    @router.route("GET", "/server/backups")
+    def backups(self):
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query["limit"][0]) if "limit" in query else None
+            if offset < 0 or (limit is not None and limit < 0):
+                raise ValueError("offset and limit should not be negative")
+        except ValueError as e:
+            self.send_error(404, str(e))
+            return
+        body = self.server.list_backups(offset, limit).encode()
+        self.send_response(200)
+        self.send_header("Content-type", "text/json")
+        self.send_header("X-Total-Count", str(len(self.server.backups)))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @router.route("GET", "/server/backups/{id}")
+    def backupinfo(self, id):
+        entry = self.server.backups.get(id)
+        if entry is None:
+            self.respond(404)
         else:
-            self.send_response(404)
-            self.end_headers()
+            keys = ("id", "time", "size", "points")
+            self.respond(200, json.dumps({k: entry[k] for k in keys}).encode())
+
+    @router.route("GET", "/server/moves")
+    def moves(self):
+        moves = [m.asdict() for m in list(self.server.scheduler.moves.values())]
+        self.respond(200, json.dumps(moves).encode())
+
+    @router.route("GET", "/server/metrics")
+    def metrics(self):
+        body = self.server.metrics.render().encode()
+        self.respond(200, body, self.server.metrics.content_type)
+
+    @router.route("GET", "/server/timing")
+    def timing(self):
+        timing = self.server.scheduler.timing.asdict()
+        self.respond(200, json.dumps(timing).encode())
+
+    @router.route("GET", "/move/{id}")
+    def move(self, id):
+        move = self.server.scheduler.get(id)
+        if move is None:
+            self.respond(404)
+        else:
+            self.respond(200, json.dumps(move.asdict()).encode())
 
-    def do_PUT(self):
-        if not self.auth():
+    def act(self, id, action, value=None):
+        """Call action (a function of Point) on a point, with value if it is not None."""
+        point = self.getpoint(id)
+        if point is None:
             return
-        commands = {
-            "moveleft": 0,
-            "moveright": 0,
-            "enable": 0,
-            "disable": 0,
-            "start": 0,
-            "move": 1,
-            "setleft": 1,
-            "setright": 1,
-            "setmid": 1,
-            "setdeltat": 1,
-            "setspeed": 1,
-            "setport": 1,
-            "setpointtype": "str",
-            "setdefault": "str",
-            "setdescription": "str",
-            "save": None,
-        }
-        elements = unquote(self.path).split("/")
-        if (
-            elements[1] == "point"
-            and elements[2] in self.server.pc
-            and (
-                elements[3] in commands
-                or "move" + elements[3] in commands
-                or "set" + elements[3] in commands
-            )
-        ):
-            d = {}
-            point = self.server.pc[elements[2]]
-            cmd = elements[3]
-            if cmd == "save":
-                method = getattr(point, cmd)
-                d = json.loads(
-                    self.rfile.read(int(self.headers.get("Content-Length", -1)))
-                )
-                self.rfile.close()
-            elif cmd in commands and hasattr(
-                point, cmd
-            ):  # first check if it is in commands to prevent checking for an attribute instead of a method
-                method = getattr(point, cmd)
-            elif hasattr(point, "move" + elements[3]):
-                cmd = "move" + elements[3]
-                method = getattr(point, cmd)
-            elif hasattr(point, "set" + elements[3]):
-                cmd = "set" + elements[3]
-                method = getattr(point, cmd)
-            else:
-                raise AttributeError(f"no such method [move|set]{elements[3]}")
+        before = point.asdict()
+        try:
+            result = action(point) if value is None else action(point, value)
+        except ValueError as e:
+            self.send_error(404, str(e))
+            return
+        after = point.asdict()
+        if any(before[k] != v for k, v in after.items() if k not in Transient):
+            args = {} if value is None else {"value": value}
+            self.server.record(action.__name__, id, **args)
+        self.server.events.changed(id, before, after)
+        body = self.server.pc.encodedpoint(id)
+        if isinstance(result, Move):
+            body = body[:-1] + f', "move": "{result.id}"}}'.encode()
+        self.respond(200, body)
+
+    @router.route("PUT", "/point/{id}/save")
+    def save(self, id):
+        try:
+            d = json.loads(self.body)
+        except ValueError as e:  # JSONDecodeError is a ValueError
+            self.send_error(404, str(e))
+            return
+        self.act(id, Point.save, d)
+
+    @router.route("POST", "/points/batch")
+    def batch(self):
+        try:
+            items = json.loads(self.body)
+            if not isinstance(items, list):
+                raise ValueError("the body should be a list of commands")
+        except ValueError as e:  # JSONDecodeError is a ValueError
+            self.send_error(404, str(e))
+            return
+        pc = self.server.pc
+        commands, errors = [], {}
+        for i, item in enumerate(items):
             try:
-                if commands[cmd] == 1:
-                    value = float(elements[4])
-                    method(value)
-                elif commands[cmd] == "str":
-                    value = elements[4]
-                    method(value)
-                elif commands[cmd] is None:
-                    method(d)
-                else:
-                    method()
+                commands.append(command(item))
             except ValueError as e:
-                self.send_error(404, str(e))
-            self.server.writeDBfile()
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            d = {
-                "point": point,
-                "freeports": list(self.server.pc.getfreeports()),
+                errors[i] = str(e)
+        if not errors:
+            before = {
+                index: pc[index].asdict() for index, _, _ in commands if index in pc
             }
-            j = json.dumps(d, cls=PointEncoder)
-            self.wfile.write(j.encode())
-        elif elements[1] == "server" and elements[2] == "backup":
-            if self.server.backup():
-                self.send_response(200)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write('{"error":"ok"}'.encode())
+            try:
+                results = pc.batch(commands)
+            except BatchError as e:
+                errors[e.position] = str(e)
+        outcomes = [
+            (
+                {"id": item.get("id"), "command": item.get("command")}
+                if isinstance(item, dict)
+                else {}
+            )
+            for item in items
+        ]
+        if errors:  # nothing was applied
+            for i, outcome in enumerate(outcomes):
+                outcome["status"] = "error" if i in errors else "skipped"
+                if i in errors:
+                    outcome["error"] = errors[i]
+            self.respond(404, json.dumps({"results": outcomes}).encode())
+            return
+        changed = False
+        for index, b in before.items():
+            after = pc[index].asdict()
+            changed |= any(b[k] != v for k, v in after.items() if k not in Transient)
+            self.server.events.changed(index, b, after)
+        if changed:  # a single record, so a batch is replayed completely or not at all
+            records = []
+            for index, function, value in commands:
+                if function.__name__ in Journaled:
+                    record = {"op": function.__name__, "index": index}
+                    if value is not None:
+                        record["value"] = value
+                    records.append(record)
+            self.server.record("batch", records=records)
+        for outcome, result in zip(outcomes, results):
+            outcome["status"] = "ok"
+            if isinstance(result, Move):
+                outcome["move"] = result.id
+        if "stream" in parse_qs(urlsplit(self.path).query, keep_blank_values=True):
+            self.respond_stream()
+            self.stream = self.progress(outcomes, results)
+        else:
+            self.respond(200, json.dumps({"results": outcomes}).encode())
+
+    def progress(self, outcomes, results):
+        """Yield a line of JSON per command, for moves once the move is finished."""
+        pending = []
+        for outcome, result in zip(outcomes, results):
+            if isinstance(result, Move):
+                pending.append((outcome, result))
             else:
-                self.send_response(500)
-                self.end_headers()
-        elif (
-            elements[1] == "server"
-            and elements[2] == "restore"
-            and self.server.known_backup(elements[3])
-        ):
-            if self.server.backup():  # make a back up first
-                if self.server.restore(elements[3]):
-                    self.send_response(200)
-                    self.send_header("Content-type", "application/json")
-                    self.end_headers()
-                    self.wfile.write('{"error":"ok"}'.encode())
-                    return
-            self.send_response(500)
-            self.end_headers()
+                yield json.dumps(outcome).encode() + b"\n"
+        while pending:
+            time.sleep(self.server.scheduler.tick)
+            for outcome, move in pending:
+                if move.done():
+                    outcome.update(status=move.status, current=move.point.current)
+                    if move.error is not None:
+                        outcome["error"] = move.error
+                    yield json.dumps(outcome).encode() + b"\n"
+            pending = [(outcome, move) for outcome, move in pending if not move.done()]
+
+    @router.route("GET", "/routes")
+    def listroutes(self):
+        routes = self.server.pc.routes
+        body = {name: routes.status(name) for name in routes.routes}
+        self.respond(200, json.dumps(body).encode())
+
+    @router.route("GET", "/route/{name}")
+    def getroute(self, name):
+        if name not in self.server.pc.routes:
+            self.respond(404)
         else:
-            self.send_response(404)
-            self.end_headers()
+            self.respond(200, json.dumps(self.server.pc.routes.status(name)).encode())
 
-    def do_DELETE(self):
-        if not self.auth():
+    @router.route("PUT", "/route/{name}")
+    def putroute(self, name):
+        try:
+            d = json.loads(self.body)
+            self.server.pc.setroute(name, d)
+        except ValueError as e:  # JSONDecodeError is a ValueError
+            self.send_error(404, str(e))
             return
-        elements = unquote(self.path).split("/")
-        if elements[1] == "point" and elements[2] in self.server.pc:
-            if len(self.server.pc) > 1:
-                del self.server.pc[elements[2]]
-                self.server.writeDBfile()
-                self.send_response(200)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(self.server.pc.dumps().encode())
-            else:
-                self.send_response(
-                    403, "Not allowed to delete last point in a collection"
+        self.server.record("route", name, route=d)
+        self.server.events.publish({"route": name, "changed": True})
+        self.respond(200, json.dumps(self.server.pc.routes.status(name)).encode())
+
+    @router.route("DELETE", "/route/{name}")
+    def deleteroute(self, name):
+        if name not in self.server.pc.routes:
+            self.respond(404)
+            return
+        self.server.pc.deleteroute(name)
+        self.server.record("deleteroute", name)
+        self.server.events.publish({"route": name, "deleted": True})
+        self.respond(200, json.dumps(self.server.pc.routes.asdict()).encode())
+
+    @router.route("PUT", "/route/{name}/set")
+    def setroute(self, name):
+        pc = self.server.pc
+        if name not in pc.routes:
+            self.respond(404)
+            return
+        try:
+            moves = pc.setroutepoints(name)
+        except ValueError as e:
+            self.send_error(409, str(e))
+            return
+        self.server.events.publish({"route": name, "set": True})
+        d = {"moves": {index: move.id for index, move in (moves or {}).items()}}
+        self.respond(200, json.dumps(d).encode())
+
+    @router.route("PUT", "/route/{name}/release")
+    def releaseroute(self, name):
+        if name not in self.server.pc.routes:
+            self.respond(404)
+            return
+        self.server.pc.routes.release(name)
+        self.server.events.publish({"route": name, "set": False})
+        self.respond(200, json.dumps(self.server.pc.routes.status(name)).encode())
+
+    def priority(self):
+        """Return the priority in the query string of the request, 0 if there is none.
+
+        Responds with 400 Bad Request and returns None if it is not a whole number.
+        """
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            return int(query.get("priority", ["0"])[0])
+        except ValueError:
+            self.send_error(400, "the priority should be a whole number")
+            return None
+
+    @router.route("PUT", "/points/move")
+    def move_many(self):
+        priority = self.priority()
+        if priority is None:
+            return
+        try:
+            targets = json.loads(self.body)
+            if not isinstance(targets, dict):
+                raise ValueError(
+                    "the body should be an object that maps ids to targets"
                 )
-                self.end_headers()
+            moves = self.server.pc.move_many(targets, priority)
+        except (KeyError, ValueError) as e:  # JSONDecodeError is a ValueError
+            self.send_error(404, str(e))
+            return
+        d = {"moves": {index: move.id for index, move in moves.items()}}
+        self.respond(200, json.dumps(d).encode())
+
+    @router.route("PUT", "/points/home")
+    def home(self):
+        priority = self.priority()
+        if priority is None:
+            return
+        moves = self.server.pc.home(priority)
+        d = {"moves": {index: move.id for index, move in moves.items()}}
+        self.respond(200, json.dumps(d).encode())
+
+    @router.route("PUT", "/server/backup")
+    def backup(self):
+        backupid = self.server.backup()
+        self.respond(200, json.dumps({"error": "ok", "id": backupid}).encode())
+
+    @router.route("PUT", "/server/restore/{id}")
+    def restore(self, id):
+        if id not in self.server.backups:
+            self.respond(404)
+        elif self.server.restore(id):
+            self.respond(200, b'{"error":"ok"}')
         else:
-            self.send_response(404)
-            self.end_headers()
+            self.respond(500)
 
-    def do_POST(self):
-        if not self.auth():
+    @router.route("DELETE", "/point/{id}")
+    def delete(self, id):
+        if self.getpoint(id) is None:
             return
-        elements = unquote(self.path).split("/")
-        if elements[1] == "points" and elements[2] == "add":
-            try:
-                point = Point(
-                    self.server.pc.getfreeport(), None, pwm=self.server.pc.pwm
-                )
-                self.server.pc[point.getindex()] = point
-                self.server.writeDBfile()
-                self.send_response(200)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                d = {
-                    "point": point,
-                    "freeports": list(self.server.pc.getfreeports()),
-                }
-                j = json.dumps(d, cls=PointEncoder)
-                self.wfile.write(j.encode())
-            except IndexError as e:
-                self.send_error(409, str(e))
+        if len(self.server.pc) > 1:
+            self.server.scheduler.cancel([self.server.pc[id]])
+            del self.server.pc[id]
+            self.server.record("delete", id)
+            self.server.events.publish({"index": id, "deleted": True})
+            self.respond(200, self.server.pc.encoded())
         else:
-            self.send_response(404)
+            self.send_response(403, "Not allowed to delete last point in a collection")
+            self.send_header("Content-Length", "0")
             self.end_headers()
 
+    @router.route("POST", "/points/add")
+    def add(self):
+        try:
+            point = Point(self.server.pc.getfreeport(), None, pwm=self.server.pc.pwm)
+            self.server.pc[point.getindex()] = point
+            self.server.record("add", point.getindex(), point=point.asdict())
+            self.server.events.changed(point.getindex(), {}, point.asdict())
+            self.respond(200, self.server.pc.encodedpoint(point.getindex()))
+        except (IndexError, KeyError) as e:
+            self.send_error(409, str(e))
+
+    @router.route("POST", "/server/token")
+    def token(self):
+        # a token must not renew itself, or a leaked token would never expire
+        scheme = self.headers["Authorization"].strip().partition(" ")[0]
+        if scheme != "Basic":
+            self.send_error(403, "a token is only issued for basic authentication")
+            return
+        token, expires = self.server.auth.token(self.user)
+        body = json.dumps({"token": token, "expires": expires}).encode()
+        self.respond(200, body)
+
+    def log_request(self, code="-", size="-"):
+        code = getattr(code, "value", code)  # an HTTPStatus
+        self.server.log.write(
+            f'"{self.requestline}" {code} {size}',
+            self.address_string(),
+            method=self.command,
+            path=self.path,
+            status=code,
+        )
+
     def log_message(self, format, *args):
         """Log an arbitrary message.
         This is used by all other logging functions.  Override
@@ -296,17 +958,42 @@ class RESTHandler(BaseHTTPRequestHandler):
         any % escapes requiring parameters, they should be
         specified as subsequent arguments (it's just like
         printf!).
-        The client ip and current date/time are prefixed to
-        every message.
+        The client ip is prefixed to every message, the logger adds the date/time.
         """
 
-        self.server.logfile.write(
-            "%s - - [%s] %s\n"
-            % (self.address_string(), self.log_date_time_string(), format % args)
-        )
+        self.server.log.write(format % args, self.address_string())
+
+
+for name, action in Actions.items():
+    router.add("PUT", f"/point/{{id}}/{name}", RESTHandler.act, action=action)
+# like left and right a move to a position goes through the scheduler
+router.add("PUT", "/point/{id}/move/{value:float}", RESTHandler.act, action=Point.goto)
+for name, (setter, kind) in Attributes.items():
+    for alias in (name, "set" + name):
+        pattern = f"/point/{{id}}/{alias}/{{value:{kind}}}"
+        router.add("PUT", pattern, RESTHandler.act, action=setter)
 
 
 class MockPWM:
+    def __init__(self, channels=16, verbose=True):
+        self.channels = channels
+        self.verbose = verbose  # print what would be sent to the controller
+
     def setServoPulse(self, port, pulse):
-        pulse = int(pulse)
-        print(f"setServoPulse {port=} {pulse=}")
+        if self.verbose:
+            pulse = int(pulse)
+            print(f"setServoPulse {port=} {pulse=}")
+
+    def setServoPulses(self, pulses):
+        if self.verbose:
+            pulses = {port: int(pulse) for port, pulse in pulses.items()}
+            print(f"setServoPulses {pulses=}")
+
+    def setServoValues(self, values):
+        if self.verbose:
+            print(f"setServoValues {values=}")
+
+    def setAllServoPulse(self, pulse):
+        if self.verbose:
+            pulse = int(pulse)
+            print(f"setAllServoPulse {pulse=}")
@@ -0,0 +1,184 @@
+import argparse
+import struct
+from threading import Lock
+from time import monotonic, sleep
+
+MAGIC = b"SIMBUS1\n"  # start of a trace file
+RECORD = struct.Struct("<QBBBB")  # nanoseconds, op, address, register, number of bytes
+WRITE, READ = 0, 1
+
+MODE1, PRESCALE = 0x00, 0xFE
+LED0_ON_L, LED15_OFF_H = 0x06, 0x45
+ALLLED_ON_L, ALLLED_OFF_H = 0xFA, 0xFD
+SLEEP, AI, RESTART = 0x10, 0x20, 0x80  # MODE1 bits
+BLOCK = 32  # maximum number of bytes in a single i2c block transfer
+
+
+class SimulatedPCA9685:
+    """The register file of a PCA9685 as far as the servo driver uses it.
+
+    Writes follow the datasheet: with the auto increment bit of MODE1 set a block
+    write fills consecutive registers, otherwise every byte goes to the same
+    register. A write to an ALL_LED register sets that register of every channel,
+    the prescaler only accepts a new value while the oscillator sleeps and the
+    restart bit always reads back as 0.
+    """
+
+    def __init__(self):
+        self.registers = bytearray(256)
+        self.registers[MODE1] = 0x11  # sleeping, responds to the all call address
+        self.registers[0x01] = 0x04  # MODE2, totem pole outputs
+        self.registers[PRESCALE] = 0x1E  # 200 Hz
+        for channel in range(16):
+            self.registers[LED0_ON_L + 4 * channel + 3] = 0x10  # full off
+
+    def write(self, reg, values):
+        for value in values:
+            if reg == PRESCALE and not self.registers[MODE1] & SLEEP:
+                pass  # ignored while the oscillator runs
+            elif ALLLED_ON_L <= reg <= ALLLED_OFF_H:
+                for channel in range(16):
+                    self.registers[LED0_ON_L + 4 * channel + reg - ALLLED_ON_L] = value
+            elif reg == MODE1:
+                self.registers[reg] = value & ~RESTART & 0xFF
+            elif reg <= LED15_OFF_H or reg == PRESCALE:
+                self.registers[reg] = value
+            if self.registers[MODE1] & AI:
+                reg = (reg + 1) & 0xFF
+
+    def read(self, reg, length):
+        values = []
+        for _ in range(length):
+            values.append(
+                0 if ALLLED_ON_L <= reg <= ALLLED_OFF_H else self.registers[reg]
+            )
+            if self.registers[MODE1] & AI:
+                reg = (reg + 1) & 0xFF
+        return values
+
+    def value(self, channel):
+        """Return the 12-bit OFF count of a channel."""
+        reg = LED0_ON_L + 4 * channel
+        return (self.registers[reg + 3] & 0x0F) << 8 | self.registers[reg + 2]
+
+
+class SimBus:
+    """Stands in for an smbus2.SMBus with PCA9685 boards at the given addresses.
+
+    Every transaction takes as long as it would on a real bus: the time to clock
+    its bits at speed Hz (9 bits per byte, including the address and register
+    bytes) plus a fixed latency per transaction. The time is kept on a clock of
+    the bus itself, so concurrent transactions queue up like on a real bus, and
+    the caller only sleeps once it is more than granularity seconds ahead, which
+    keeps the timing right on average without busy waiting.
+
+    With trace, every transaction is appended to that file as a 12-byte record
+    (time in ns, op, address, register, number of bytes) followed by the bytes,
+    see readtrace().
+    """
+
+    granularity = 0.001  # seconds
+
+    def __init__(self, addresses=(0x40,), speed=400000, latency=0.0001, trace=None):
+        self.devices = {address: SimulatedPCA9685() for address in addresses}
+        self.speed = speed  # Hz, 100000 for standard mode, 400000 for fast mode
+        self.latency = latency  # seconds of overhead per transaction
+        self.lock = Lock()
+        self.start = monotonic()
+        self.clock = self.start  # the time the bus is free again
+        self.transactions = 0
+        self.bytes = 0  # bytes on the wire, including address and register bytes
+        self.busy = 0.0  # seconds the bus was in use
+        self.trace = None
+        if trace is not None:
+            self.trace = open(trace, "wb")
+            self.trace.write(MAGIC)
+
+    def device(self, address):
+        device = self.devices.get(address)
+        if device is None:  # what smbus2 raises when nobody acknowledges the address
+            raise OSError(121, "Remote I/O error")
+        return device
+
+    def transfer(self, op, address, reg, values, wire):
+        """Account for a transaction of wire bytes on the bus, and wait if we are ahead."""
+        duration = self.latency + (9 * wire + 2) / self.speed  # plus start and stop
+        with self.lock:
+            now = monotonic()
+            start = max(now, self.clock)
+            self.clock = start + duration
+            self.transactions += 1
+            self.bytes += wire
+            self.busy += duration
+            if self.trace is not None:
+                ns = round((start - self.start) * 1e9)
+                self.trace.write(RECORD.pack(ns, op, address, reg, len(values)))
+                self.trace.write(bytes(values))
+            ahead = self.clock - now
+        if ahead > self.granularity:
+            sleep(ahead)
+
+    def write_byte_data(self, address, reg, value):
+        self.device(address).write(reg, [value])
+        self.transfer(WRITE, address, reg, [value], 3)
+
+    def write_i2c_block_data(self, address, reg, values):
+        if len(values) > BLOCK:
+            raise ValueError(f"Data length cannot exceed {BLOCK} bytes")
+        self.device(address).write(reg, values)
+        self.transfer(WRITE, address, reg, values, 2 + len(values))
+
+    def read_byte_data(self, address, reg):
+        return self.read_i2c_block_data(address, reg, 1)[0]
+
+    def read_i2c_block_data(self, address, reg, length):
+        if length > BLOCK:
+            raise ValueError(f"Desired block length over {BLOCK} bytes")
+        values = self.device(address).read(reg, length)
+        # address and register, then a repeated start with the address again
+        self.transfer(READ, address, reg, values, 3 + length)
+        return values
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+
+def readtrace(path):
+    """Yield the (seconds, op, address, register, bytes) tuples of the transactions in a trace file."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        while header := f.read(RECORD.size):
+            if len(header) < RECORD.size:
+                break  # a partially written last record
+            ns, op, address, reg, length = RECORD.unpack(header)
+            yield ns / 1e9, op, address, reg, f.read(length)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        prog="python -m point.simbus",
+        description="Print a trace file written by the i2c bus simulator (python -m point --simulate --trace FILE)",
+    )
+    argparser.add_argument("trace", help="the trace file")
+    argparser.add_argument(
+        "-s",
+        "--summary",
+        default=False,
+        action="store_true",
+        help="only print the number of transactions and bytes per address",
+    )
+    args = argparser.parse_args()
+    totals = {}
+    for seconds, op, address, reg, data in readtrace(args.trace):
+        n, size = totals.get(address, (0, 0))
+        totals[address] = (n + 1, size + len(data))
+        if not args.summary:
+            print(
+                f"{seconds:12.6f} 0x{address:02X} {'WR'[op]} 0x{reg:02X} {data.hex(' ')}"
+            )
+    if args.summary:
+        for address, (n, size) in sorted(totals.items()):
+            print(f"0x{address:02X} {n} transactions {size} bytes")
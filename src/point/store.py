@@ -0,0 +1,154 @@
+import json
+import os
+from json.decoder import JSONDecodeError
+from os.path import abspath, basename, dirname
+from stat import S_IMODE
+from tempfile import mkstemp
+from threading import Condition, Event, Thread
+from time import monotonic, perf_counter
+
+
+def atomic_write(path, data):
+    """Replace the contents of path with data (str or bytes) so that it is either completely old or completely new."""
+    directory = dirname(abspath(path))
+    fd, tmp = mkstemp(dir=directory, prefix=basename(path) + ".", suffix=".tmp")
+    try:
+        # mkstemp creates files only readable by the owner, keep the permissions we had
+        os.chmod(tmp, S_IMODE(os.stat(path).st_mode) if os.path.exists(path) else 0o644)
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    try:  # make sure the rename itself is on disk
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:  # not every platform allows opening a directory
+        pass
+
+
+class Journal:
+    """Persists changes as an append-only journal next to a snapshot file.
+
+    Every change is recorded with record() as a single line of JSON. Records are
+    appended to path + ".journal" by a background thread, in batches of everything
+    recorded within delay seconds. Once the journal grows beyond limit bytes, the
+    snapshot in path is rewritten and the journal truncated.
+
+    snapshot is a callable that returns a (data, seq) tuple, where data is the complete
+    snapshot and seq the value of Journal.seq at the moment the snapshot was taken.
+    Replaying a journal on top of a snapshot that already contains some of its
+    records is harmless because replaying a record is idempotent.
+    """
+
+    def __init__(self, path, snapshot, delay=1.0, limit=65536):
+        self.path = path
+        self.journal = path + ".journal"
+        self.snapshot = snapshot
+        self.delay = delay
+        self.limit = limit
+        self.seq = 0  # number of the last record
+        self.queue = []  # (seq, line) tuples not yet written
+        self.requests = []  # Events of callers waiting for a compaction
+        self.closed = False
+        self.size = os.path.getsize(self.journal) if os.path.exists(self.journal) else 0
+        self.appends = 0
+        self.appendtime = 0.0  # total seconds spent appending
+        self.compactions = 0
+        self.compactiontime = 0.0  # total seconds spent rewriting the snapshot
+        self.condition = Condition()
+        self.thread = Thread(target=self.run, name="journal", daemon=True)
+        self.thread.start()
+
+    def replay(self, apply):
+        """Call apply with every record in the journal, returns the number of records."""
+        n = 0
+        if os.path.exists(self.journal):
+            with open(self.journal) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except JSONDecodeError:
+                        continue  # a partially written last line after a crash
+                    apply(record)
+                    n += 1
+        return n
+
+    def record(self, record):
+        line = json.dumps(record) + "\n"
+        with self.condition:
+            self.seq += 1
+            self.queue.append((self.seq, line))
+            self.condition.notify()
+
+    def compact(self, wait=True):
+        """Rewrite the snapshot and truncate the journal.
+
+        Do not wait while holding a lock that snapshot needs.
+        """
+        done = Event()
+        with self.condition:
+            self.requests.append(done)
+            self.condition.notify()
+        if wait:
+            done.wait()
+
+    def close(self):
+        """Write all pending records and stop the background thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not (self.queue or self.requests or self.closed):
+                    self.condition.wait()
+                # give other changes the chance to join this batch
+                deadline = monotonic() + self.delay
+                while not (self.requests or self.closed):
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                queue, self.queue = self.queue, []
+                requests, self.requests = self.requests, []
+                closed = self.closed
+            if queue:
+                self.append(line for _, line in queue)
+            if requests or self.size > self.limit:
+                self.rewrite()
+            for done in requests:
+                done.set()
+            if closed:
+                break
+
+    def append(self, lines):
+        start = perf_counter()
+        with open(self.journal, "a") as f:
+            for line in lines:
+                f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            self.size = f.tell()
+        self.appends += 1
+        self.appendtime += perf_counter() - start
+
+    def rewrite(self):
+        start = perf_counter()
+        data, seq = self.snapshot()
+        atomic_write(self.path, data)
+        with self.condition:  # anything recorded after the snapshot will go into the new journal
+            self.queue = [(s, line) for s, line in self.queue if s > seq]
+        atomic_write(self.journal, "")
+        self.size = 0
+        self.compactions += 1
+        self.compactiontime += perf_counter() - start
@@ -0,0 +1,181 @@
+import unittest
+
+from point.motion import MotionScheduler
+from point.point import Point, PointCollection
+from point.server import MockPWM
+
+
+class Scheduler(MotionScheduler):
+    """A MotionScheduler whose ticks are run by the test instead of its thread."""
+
+    def run(self):
+        pass
+
+    def advance(self):
+        with self.condition:
+            active = list(self.active)
+        self.now += self.tick
+        self.step(active, self.now)
+        self.finish()
+
+    def idle(self, ticks=1000):
+        for _ in range(ticks):
+            if not self.active and not self.waiting:
+                return
+            self.advance()
+        raise AssertionError("moves did not finish")
+
+
+class TestMotionScheduler(unittest.TestCase):
+    def setUp(self):
+        self.pwm = MockPWM(channels=32, verbose=False)
+        self.pc = PointCollection(pwm=self.pwm)
+        for port in range(5):
+            point = Point(port, f"Point {port}", self.pwm)
+            point.enable()
+            point.setleft(-0.5)
+            point.setright(0.5)
+            point.setspeed(2)
+            self.pc[point.getindex()] = point
+        self.points = list(self.pc.values())
+
+    def scheduler(self, **kwargs):
+        scheduler = Scheduler(**kwargs)
+        scheduler.now = 0.0
+        self.pc.setscheduler(scheduler)
+        return scheduler
+
+    def assertIdle(self, scheduler):
+        self.assertEqual(scheduler.active, [])
+        self.assertEqual(scheduler.waiting, [])
+        self.assertEqual(scheduler.points, {})
+        self.assertEqual(scheduler.inflight(), 0)
+        self.assertAlmostEqual(scheduler.used, 0)
+
+    def test_preempt_before_first_tick(self):
+        scheduler = self.scheduler()
+        point = self.points[0]
+        first = point.moveleft()
+        second = point.moveright()
+        third = point.moveleft()
+        self.assertEqual(first.status, "preempted")
+        self.assertEqual(second.status, "preempted")
+        self.assertEqual(scheduler.inflight(), 1)
+        scheduler.idle()
+        self.assertEqual(third.status, "done")
+        self.assertEqual(point.current, -0.5)
+        self.assertIdle(scheduler)
+
+    def test_preempt_twice_in_one_tick(self):
+        scheduler = self.scheduler(budget=0.5)
+        point = self.points[0]
+        first = point.moveright()
+        for _ in range(5):
+            scheduler.advance()
+        self.assertEqual(first.status, "running")
+        moved = point.current
+        point.moveleft()
+        last = point.goto(0.25)
+        self.assertEqual(scheduler.inflight(), 1)
+        self.assertAlmostEqual(scheduler.used, 0.5)
+        scheduler.advance()
+        self.assertEqual(last.start, moved)  # from where the point was
+        scheduler.idle()
+        self.assertEqual(last.status, "done")
+        self.assertEqual(point.current, 0.25)
+        self.assertIdle(scheduler)
+
+    def test_preempt_waiting(self):
+        scheduler = self.scheduler(budget=0.5)
+        running = self.points[0].moveright()
+        waiting = self.points[1].moveright()
+        replaced = self.points[1].moveleft()
+        self.assertEqual(waiting.status, "preempted")
+        self.assertEqual([entry[2] for entry in scheduler.waiting], [replaced])
+        scheduler.idle()
+        self.assertEqual((running.status, replaced.status), ("done", "done"))
+        self.assertEqual(self.points[1].current, -0.5)
+        self.assertIdle(scheduler)
+
+    def test_duplicate_and_noop(self):
+        scheduler = self.scheduler()
+        point = self.points[0]
+        move = point.moveright()
+        self.assertIs(point.moveright(), move)
+        scheduler.idle()
+        noop = point.moveright()
+        self.assertEqual(noop.status, "done")
+        self.assertIdle(scheduler)
+
+    def test_home_then_move_under_budget(self):
+        scheduler = self.scheduler(budget=1.0)
+        for point in self.points:
+            point.setdefault("right")
+        self.pc.home()
+        moves = self.pc.move_many({p.getindex(): "left" for p in self.points})
+        scheduler.idle()
+        self.assertEqual({m.status for m in moves.values()}, {"done"})
+        self.assertEqual({p.current for p in self.points}, {-0.5})
+        self.assertIdle(scheduler)
+
+    def test_start_is_home(self):
+        scheduler = self.scheduler()
+        for point, default in zip(self.points, ("left", "right", "mid")):
+            point.setmid(0.25)
+            point.setdefault(default)
+        self.pc.home()
+        scheduler.idle()
+        homes = [point.current for point in self.points[:3]]
+        self.assertEqual(homes, [-0.5, 0.5, 0.25])
+        for point in self.points[:3]:
+            point.goto(0)
+            point.movestart()
+        scheduler.idle()
+        self.assertEqual([point.current for point in self.points[:3]], homes)
+
+    def test_preempt_during_tick(self):
+        scheduler = self.scheduler()
+        point = self.points[0]
+        first = point.moveright()
+        begin = first.begin
+        moves = []
+
+        def preempt():  # another request while the tick starts the move
+            moves.append(point.moveleft())
+            begin()
+
+        first.begin = preempt
+        scheduler.advance()
+        self.assertEqual(first.status, "preempted")
+        scheduler.idle()
+        self.assertEqual((first.status, moves[0].status), ("preempted", "done"))
+        self.assertEqual(point.current, -0.5)
+        self.assertIdle(scheduler)
+
+    def test_move_to_position(self):
+        scheduler = self.scheduler()
+        point = self.points[0]
+        point.moveright()
+        scheduler.advance()
+        moves = self.pc.batch([(point.getindex(), Point.goto, 0.25)])
+        self.assertEqual(moves[0].status, "queued")
+        with self.assertRaises(ValueError):
+            point.goto(float("nan"))
+        scheduler.idle()
+        self.assertEqual(moves[0].status, "done")
+        self.assertEqual(point.current, 0.25)
+        self.assertIdle(scheduler)
+
+    def test_cancel(self):
+        scheduler = self.scheduler(budget=0.5)
+        running = self.points[0].moveright()
+        waiting = self.points[1].moveright()
+        scheduler.advance()
+        scheduler.cancel(self.points[:2])
+        self.assertEqual((running.status, waiting.status), ("cancelled", "cancelled"))
+        scheduler.advance()
+        self.assertIdle(scheduler)
+
+
+if __name__ == "__main__":
+    unittest.main()
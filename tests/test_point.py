@@ -0,0 +1,139 @@
+import json
+import unittest
+
+from point.point import BatchError, Point, PointCollection, Schema
+from point.server import MockPWM
+
+
+class TestCodec(unittest.TestCase):
+    def setUp(self):
+        self.pwm = MockPWM(channels=32, verbose=False)
+        self.point = Point(3, "Point 3", self.pwm, default="right", pointtype="wye")
+        self.point.save(
+            {
+                "enabled": True,
+                "description": 'a "quoted"\tdescription é',
+                "_left": -0.25,
+                "_right": 0.75,
+                "speed": 1.5,
+                "profile": "scurve",
+                "cost": 1,
+            }
+        )
+
+    def test_dumps_is_json(self):
+        d = json.loads(self.point.dumps())
+        self.assertEqual(list(d), list(Schema))
+        self.assertEqual(d, self.point.asdict())
+
+    def test_round_trip(self):
+        copy = Point.loadd(json.loads(self.point.dumps()), self.pwm)
+        self.assertEqual(copy.dumps(), self.point.dumps())
+        self.assertEqual(copy.asdict(), self.point.asdict())
+        self.assertIs(type(copy.cost), float)
+
+    def test_collection_round_trip(self):
+        pc = PointCollection(pwm=self.pwm)
+        pc[self.point.getindex()] = self.point
+        pc[self.point.getindex() + "x"] = Point(4, "Point 4", self.pwm)
+        self.assertEqual(
+            PointCollection.loads(pc.dumps(), self.pwm).dumps(), pc.dumps()
+        )
+
+    def test_defaults(self):
+        point = Point.loadd({"port": 5}, self.pwm)
+        self.assertEqual(point.name, "Point on port 5")
+        for k in ("enabled", "current", "speed", "default", "profile", "cost"):
+            self.assertEqual(getattr(point, k), Schema[k][0])
+
+    def test_unknown_attribute(self):
+        with self.assertRaisesRegex(ValueError, "unknown attribute color"):
+            Point.loadd({"port": 1, "color": "red"}, self.pwm)
+
+    def test_out_of_range(self):
+        for k, v in (
+            ("_left", 1.5),
+            ("_right", float("nan")),
+            ("speed", "fast"),
+            ("port", 32),
+            ("enabled", 1),
+            ("default", "up"),
+            ("cost", -1),
+        ):
+            with self.subTest(k=k), self.assertRaises(ValueError):
+                Point.loadd({"port": 1, k: v}, self.pwm)
+
+    def test_current_is_clamped(self):
+        for value, expected in (
+            (1.5, 1.0),
+            (-3, -1.0),
+            (float("nan"), 0.0),
+            ("x", 0.0),
+        ):
+            with self.subTest(value=value):
+                point = Point.loadd({"port": 1, "current": value}, self.pwm)
+                self.assertEqual(point.current, expected)
+
+    def test_move_checks_position(self):
+        for value in (1.5, float("inf"), float("nan")):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                self.point.move(value)
+        self.point.move(0.5)
+        self.assertEqual(self.point.current, 0.5)
+
+    def test_save_is_all_or_nothing(self):
+        before = self.point.dumps()
+        for d in (
+            {"_left": 0.5, "speed": 10},
+            {"description": "new", "color": "red"},
+            {"_mid": 0.1, "index": "other"},
+        ):
+            with self.subTest(d=d), self.assertRaises(ValueError):
+                self.point.save(d)
+            self.assertEqual(self.point.dumps(), before)
+        self.point.save({"_left": 0.5, "description": "new"})
+        self.assertEqual((self.point._left, self.point.description), (0.5, "new"))
+
+    def test_dumps_follows_changes(self):
+        self.point.dumps()
+        self.point.setleft(-0.5)
+        self.assertEqual(json.loads(self.point.dumps())["_left"], -0.5)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.pwm = MockPWM(channels=32, verbose=False)
+        self.pc = PointCollection(pwm=self.pwm)
+        for port in range(2):
+            point = Point(port, f"Point {port}", self.pwm)
+            point.enable()
+            self.pc[point.getindex()] = point
+        self.first, self.second = self.pc
+
+    def test_batch(self):
+        self.pc.batch(
+            [
+                (self.first, Point.setleft, -0.5),
+                (self.first, Point.moveleft, None),
+                (self.second, Point.goto, 0.25),
+            ]
+        )
+        self.assertEqual(self.pc[self.first].current, -0.5)
+        self.assertEqual(self.pc[self.second].current, 0.25)
+
+    def test_rejected_move_changes_nothing(self):
+        before = self.pc.dumps()
+        for value in (float("nan"), float("inf"), 2.0):
+            commands = [
+                (self.first, Point.setleft, -0.5),
+                (self.first, Point.moveleft, None),
+                (self.second, Point.goto, value),
+            ]
+            with self.subTest(value=value), self.assertRaises(BatchError) as cm:
+                self.pc.batch(commands)
+            self.assertEqual(cm.exception.position, 2)
+            self.assertEqual(self.pc.dumps(), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from point import store
+from point.point import Point, PointCollection
+from point.server import MockPWM
+from point.store import Journal
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "points.json")
+        self.pwm = MockPWM(channels=32, verbose=False)
+        self.pc = PointCollection(pwm=self.pwm)
+        self.journal = Journal(self.path, self.snapshot, delay=0)
+
+    def tearDown(self):
+        self.journal.close()
+        self.directory.cleanup()
+
+    def snapshot(self):
+        return self.pc.dumps(), self.journal.seq
+
+    def record(self, op, index=None, **kwargs):
+        """Record a change like Server.record() does."""
+        kwargs.update(op=op, index=index)
+        self.journal.record(kwargs)
+
+    def add(self, port):
+        point = Point(port, f"Point {port}", self.pwm)
+        self.pc[point.getindex()] = point
+        self.record("add", point.getindex(), point=point.asdict())
+        return point.getindex()
+
+    def change(self, index, op, value):
+        getattr(self.pc[index], op)(value)
+        self.record(op, index, value=value)
+
+    def changes(self):
+        """Make changes of every kind, returns the index of a point that is kept."""
+        first, second, third = self.add(0), self.add(1), self.add(2)
+        self.change(first, "setdescription", "first")
+        self.change(first, "setleft", -0.25)
+        self.change(second, "setdefault", "right")
+        del self.pc[third]
+        self.record("delete", third)
+        route = {"positions": {first: "left", second: "right"}, "description": ""}
+        self.pc.apply({"op": "route", "index": "main", "route": route})
+        self.record("route", "main", route=route)
+        self.pc[second].setspeed(1.0)
+        self.pc[second].setprofile("scurve")
+        records = [
+            {"op": "setspeed", "index": second, "value": 1.0},
+            {"op": "setprofile", "index": second, "value": "scurve"},
+        ]
+        self.record("batch", records=records)
+        return first
+
+    def recover(self):
+        """Return the points as the server finds them after a restart."""
+        pc = PointCollection(pwm=self.pwm)
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                pc = PointCollection.loads(f.read(), self.pwm)
+        journal = Journal(self.path, lambda: (pc.dumps(), 0), delay=0)
+        try:
+            journal.replay(pc.apply)
+        finally:
+            journal.close()
+        return pc
+
+    def test_replay(self):
+        self.changes()
+        self.journal.close()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(self.recover().dumps(), self.pc.dumps())
+
+    def test_compact(self):
+        first = self.changes()
+        self.journal.compact()
+        self.assertEqual(os.path.getsize(self.path + ".journal"), 0)
+        self.change(first, "setright", 0.75)
+        self.journal.close()
+        self.assertEqual(self.recover().dumps(), self.pc.dumps())
+
+    def test_crash_during_compaction(self):
+        self.changes()
+        self.journal.close()
+
+        def crash(path, data):
+            if path.endswith(".journal"):
+                raise OSError("crash")
+            write(path, data)
+
+        write = store.atomic_write
+        with mock.patch.object(store, "atomic_write", crash):
+            with self.assertRaises(OSError):
+                self.journal.rewrite()
+        # the snapshot is written, the journal still holds the records in it
+        self.assertGreater(os.path.getsize(self.path + ".journal"), 0)
+        self.assertEqual(self.recover().dumps(), self.pc.dumps())
+
+    def test_rewrite_keeps_later_records(self):
+        first = self.changes()
+        self.journal.close()
+        self.change(first, "setdescription", "in the snapshot")
+        snapshot = self.snapshot()
+        self.change(first, "setdescription", "after the snapshot")
+        self.journal.snapshot = lambda: snapshot
+        self.journal.rewrite()
+        self.assertEqual(len(self.journal.queue), 1)
+        self.journal.append(line for _, line in self.journal.queue)
+        self.assertEqual(self.recover().dumps(), self.pc.dumps())
+        self.assertEqual(self.recover()[first].description, "after the snapshot")
+
+
+if __name__ == "__main__":
+    unittest.main()